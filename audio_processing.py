@@ -1,3 +1,5 @@
+import functools
+
 import torch
 import numpy as np
 from scipy.signal import get_window
@@ -42,18 +44,43 @@ def window_sumsquare(window, n_frames, hop_length=200, win_length=800,
         win_length = n_fft
 
     n = n_fft + hop_length * (n_frames - 1)
-    x = np.zeros(n, dtype=dtype)
 
     # Compute the squared window at the desired length
     win_sq = get_window(window, win_length, fftbins=True)
     win_sq = librosa_util.normalize(win_sq, norm=norm)**2
-    win_sq = librosa_util.pad_center(win_sq, n_fft)
+    win_sq = librosa_util.pad_center(win_sq, size=n_fft)
+
+    # Fill the envelope, overlap-adding hop sized blocks of every frame at once
+    n_blocks = -(-n_fft // hop_length)
+    win_sq = np.pad(win_sq, (0, n_blocks * hop_length - n_fft))
+    x = np.zeros((n_frames + n_blocks - 1, hop_length))
+    for i, block in enumerate(win_sq.reshape(n_blocks, hop_length)):
+        x[i:i + n_frames] += block
+    x = x.ravel()[:n]
+    return x.astype(dtype)
+
+
+@functools.lru_cache(maxsize=64)
+def cached_window_sumsquare(window, n_frames, hop_length, win_length, n_fft,
+                            device):
+    """
+    window_sumsquare envelope as float32 tensors on `device`, cached per
+    argument set so repeated inverse STFTs of the same length (Griffin-Lim
+    iterations) do not recompute it or copy it to the device again.
 
-    # Fill the envelope
-    for i in range(n_frames):
-        sample = i * hop_length
-        x[sample:min(n, sample + n_fft)] += win_sq[:max(0, min(n_fft, n - sample))]
-    return x
+    Returns
+    -------
+    divisor : torch.Tensor, the envelope with 1 where it is below tiny, so the
+        inverse transform can be divided by it without indexing
+    nonzero : torch.BoolTensor, where the envelope is above tiny
+    """
+    window_sum = window_sumsquare(
+        window, n_frames, hop_length=hop_length, win_length=win_length,
+        n_fft=n_fft, dtype=np.float32)
+    nonzero = window_sum > librosa_util.tiny(window_sum)
+    divisor = np.where(nonzero, window_sum, 1).astype(np.float32)
+    return (torch.from_numpy(divisor).to(device),
+            torch.from_numpy(nonzero).to(device))
 
 
 def griffin_lim(magnitudes, stft_fn, n_iters=30):
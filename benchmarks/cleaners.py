@@ -0,0 +1,83 @@
+""" Checks that english_cleaners gives the same output as the original
+sequential pipeline (18 abbreviation passes, unmemoized number expansion)
+over the bundled filelists and reports the throughput of both, and of
+text.clean_texts across a process pool.
+
+python benchmarks/cleaners.py --n_workers 8
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from text import clean_texts, cleaners, numbers
+from utils import load_filepaths_and_text
+
+EXTRA_TEXTS = [
+    "Dr. St. John met Mr. and Mrs. Smith, Jr. at Ft. Worth.",
+    "dr.st. co.ltd. Capt.Col. gen.", "mr..", "Drs. Lt. Hon. Sgt. Esq. Maj. Rev.",
+    "It cost $3.50, or 1,234,567 pounds, on the 21st of May, 1999.",
+    "£12 in 2005, 1900, 2000, 1066, 0.5 and 007 and 3rd and 100th.",
+]
+
+
+def reference_normalize_numbers(text):
+    expand_number = lambda m: numbers._number_to_words.__wrapped__(int(m.group(0)))
+    expand_ordinal = lambda m: numbers._ordinal_to_words.__wrapped__(m.group(0))
+    text = re.sub(numbers._comma_number_re, numbers._remove_commas, text)
+    text = re.sub(numbers._pounds_re, r'\1 pounds', text)
+    text = re.sub(numbers._dollars_re, numbers._expand_dollars, text)
+    text = re.sub(numbers._decimal_number_re, numbers._expand_decimal_point, text)
+    text = re.sub(numbers._ordinal_re, expand_ordinal, text)
+    text = re.sub(numbers._number_re, expand_number, text)
+    return text
+
+
+def reference_english_cleaners(text):
+    text = cleaners.convert_to_ascii(text)
+    text = cleaners.lowercase(text)
+    text = reference_normalize_numbers(text)
+    text = cleaners._expand_abbreviations_sequential(text)
+    text = cleaners.collapse_whitespace(text)
+    return text
+
+
+def lines_per_second(fn, texts):
+    start = time.perf_counter()
+    fn(texts)
+    return len(texts) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filelists', type=str, default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'filelists', '*.txt'))
+    parser.add_argument('--n_workers', type=int, default=None)
+    args = parser.parse_args()
+
+    texts = list(EXTRA_TEXTS)
+    for filelist in sorted(glob.glob(args.filelists)):
+        texts += [x[1] for x in load_filepaths_and_text(filelist)]
+
+    mismatches = [text for text in texts if
+                  cleaners.english_cleaners(text) != reference_english_cleaners(text)]
+    for text in mismatches[:10]:
+        print("MISMATCH {!r}\n  {!r}\n  {!r}".format(
+            text, cleaners.english_cleaners(text), reference_english_cleaners(text)))
+    print("{} lines, {} mismatches".format(len(texts), len(mismatches)))
+
+    reference = lines_per_second(
+        lambda x: [reference_english_cleaners(t) for t in x], texts)
+    numbers._number_to_words.cache_clear()
+    numbers._ordinal_to_words.cache_clear()
+    current = lines_per_second(
+        lambda x: [cleaners.english_cleaners(t) for t in x], texts)
+    pool = lines_per_second(
+        lambda x: clean_texts(x, ['english_cleaners'], args.n_workers), texts)
+    print("reference   {:10.0f} lines/s".format(reference))
+    print("cleaners    {:10.0f} lines/s {:6.2f}x".format(current, current / reference))
+    print("clean_texts {:10.0f} lines/s {:6.2f}x".format(pool, pool / reference))
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,116 @@
+""" Collate time per batch of TextMelCollate against the previous
+per-field loops, on random items shaped like training data
+
+python benchmarks/collate.py --batch_size 64 --phones_words_utterance 1,0,1
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from data_utils import TextMelCollate
+
+
+def legacy_collate(batch, n_frames_per_step):
+    """ TextMelCollate before vectorization, one loop per field and all 12
+    emotion intensity channels """
+    input_lengths, ids_sorted_decreasing = torch.sort(
+        torch.LongTensor([len(x[0]) for x in batch]),
+        dim=0, descending=True)
+    max_input_len = input_lengths[0]
+
+    text_padded = torch.LongTensor(len(batch), max_input_len)
+    text_padded.zero_()
+    for i in range(len(ids_sorted_decreasing)):
+        text = batch[ids_sorted_decreasing[i]][0]
+        text_padded[i, :text.size(0)] = text
+
+    num_mels = batch[0][1].size(0)
+    max_target_len = max([x[1].size(1) for x in batch])
+    if max_target_len % n_frames_per_step != 0:
+        max_target_len += n_frames_per_step - max_target_len % n_frames_per_step
+
+    mel_padded = torch.FloatTensor(len(batch), num_mels, max_target_len)
+    mel_padded.zero_()
+    gate_padded = torch.FloatTensor(len(batch), max_target_len)
+    gate_padded.zero_()
+    output_lengths = torch.LongTensor(len(batch))
+    for i in range(len(ids_sorted_decreasing)):
+        mel = batch[ids_sorted_decreasing[i]][1]
+        mel_padded[i, :, :mel.size(1)] = mel
+        gate_padded[i, mel.size(1)-1:] = 1
+        output_lengths[i] = mel.size(1)
+
+    ed_padded = torch.FloatTensor(len(batch), 12, max_input_len)
+    ed_padded.zero_()
+    for i in range(len(ids_sorted_decreasing)):
+        ed = batch[ids_sorted_decreasing[i]][2]
+        ed_padded[i, :, :ed.size(1)] = ed
+
+    sp_padded = torch.FloatTensor(len(batch), 3, max_input_len)
+    sp_padded.zero_()
+    for i in range(len(ids_sorted_decreasing)):
+        sp = batch[ids_sorted_decreasing[i]][3]
+        sp_padded[i, :, :sp.size(1)] = sp
+
+    return text_padded, input_lengths, mel_padded, gate_padded, \
+        output_lengths, ed_padded, sp_padded
+
+
+def random_batch(batch_size, n_mel_channels, seed):
+    generator = torch.Generator().manual_seed(seed)
+    batch = []
+    for _ in range(batch_size):
+        text_length = int(torch.randint(20, 200, (1,), generator=generator))
+        mel_length = int(torch.randint(100, 1000, (1,), generator=generator))
+        batch.append((torch.randint(1, 148, (text_length,), generator=generator).int(),
+                      torch.randn(n_mel_channels, mel_length, generator=generator),
+                      torch.rand(12, text_length, generator=generator),
+                      torch.rand(3, text_length, generator=generator),
+                      {}))
+    return batch
+
+
+def ms_per_batch(collate_fn, batches):
+    collate_fn(batches[0])
+    start = time.perf_counter()
+    for batch in batches:
+        collate_fn(batch)
+    return (time.perf_counter() - start) / len(batches) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--n_mel_channels', type=int, default=80)
+    parser.add_argument('--n_batches', type=int, default=50)
+    parser.add_argument('--n_frames_per_step', type=int, default=1)
+    parser.add_argument('--phones_words_utterance', type=str, default='1,1,1')
+    parser.add_argument('--pin_memory', action='store_true')
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    ed_bool_list = np.array(
+        [bool(int(x)) for x in args.phones_words_utterance.split(',')]).repeat(4)
+    collate = TextMelCollate(args.n_frames_per_step, ed_bool_list,
+                             pin_memory=args.pin_memory)
+    batches = [random_batch(args.batch_size, args.n_mel_channels, seed)
+               for seed in range(args.n_batches)]
+
+    # same batch as before, with the unselected channels dropped
+    reference = legacy_collate(batches[0], args.n_frames_per_step)
+    output = collate(batches[0])
+    reference = reference[:5] + (reference[5][:, ed_bool_list], reference[6])
+    assert all(torch.equal(a, b) for a, b in zip(reference, output)), \
+        "TextMelCollate output differs from the legacy collate"
+
+    legacy = ms_per_batch(lambda b: legacy_collate(b, args.n_frames_per_step),
+                          batches)
+    current = ms_per_batch(collate, batches)
+    print("legacy        {:8.2f} ms/batch".format(legacy))
+    print("TextMelCollate {:7.2f} ms/batch {:6.2f}x".format(
+        current, legacy / current))
@@ -0,0 +1,79 @@
+""" Compares the per-step cost of Decoder.decode and Decoder.decode_inplace
+on CPU: operators that allocate a new tensor and the bytes they allocate,
+counted with the profiler, and wall clock latency per decoder step.
+
+python benchmarks/decoder_step.py --config config_sho.json --batch_size 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+from torch.profiler import profile, ProfilerActivity
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hparams import create_hparams_from_json
+from model import Tacotron2
+
+def run_steps(decoder, memory, n_steps, workspace):
+    decoder.initialize_decoder_states(memory, mask=None)
+    if workspace:
+        decoder.initialize_decoder_workspace(n_steps)
+    decoder_input = decoder.get_go_frame(memory)
+    for step in range(n_steps):
+        decoder_input = decoder.prenet(decoder_input)
+        if workspace:
+            decoder_input, _, _ = decoder.decode_inplace(decoder_input, step)
+        else:
+            decoder_input, _, _ = decoder.decode(decoder_input)
+
+
+def count_allocations(decoder, memory, n_steps, workspace):
+    # warm up once so lazy initialisation does not show up in the count
+    run_steps(decoder, memory, 1, workspace)
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        run_steps(decoder, memory, n_steps, workspace)
+    allocations = [e.self_cpu_memory_usage for e in prof.events()
+                   if e.name != '[memory]' and e.self_cpu_memory_usage > 0]
+    return len(allocations) / n_steps, sum(allocations) / n_steps
+
+
+def time_steps(decoder, memory, n_steps, workspace, repeats):
+    run_steps(decoder, memory, n_steps, workspace)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        run_steps(decoder, memory, n_steps, workspace)
+    return (time.perf_counter() - start) / (repeats * n_steps)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', type=str, default='config_sho.json')
+    parser.add_argument('--hparams', type=str, required=False,
+                        help='comma separated name=value pairs')
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--input_length', type=int, default=150)
+    parser.add_argument('--n_steps', type=int, default=100)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    hparams = create_hparams_from_json(args.config, args.hparams)
+    decoder = Tacotron2(hparams).eval().decoder
+    memory = torch.randn(args.batch_size, args.input_length,
+                         decoder.encoder_embedding_dim)
+
+    print("batch {} input length {} threads {}".format(
+        args.batch_size, args.input_length, torch.get_num_threads()))
+    with torch.no_grad():
+        for name, workspace in (("decode", False), ("decode_inplace", True)):
+            n_allocs, n_bytes = count_allocations(decoder, memory, 20, workspace)
+            latency = time_steps(
+                decoder, memory, args.n_steps, workspace, args.repeats)
+            print("{:16s} {:6.1f} allocations/step {:8.1f} KB/step "
+                  "{:8.3f} ms/step".format(
+                      name, n_allocs, n_bytes / 1024, latency * 1000))
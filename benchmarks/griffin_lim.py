@@ -0,0 +1,82 @@
+""" Spectral convergence and CPU time of audio_processing.griffin_lim run on
+one item at a time against the batched vocoder.GriffinLim, with and without
+momentum, on mels of slices of a wav
+
+python benchmarks/griffin_lim.py --wav demo.wav --batch_size 8 --threads 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import librosa
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from audio_processing import griffin_lim
+from layers import TacotronSTFT
+from vocoder import GriffinLim, spectral_convergence
+
+
+def mean_convergence(stft, magnitudes, mel_lengths, audios):
+    convergence = []
+    for magnitude, mel_length, audio in zip(magnitudes, mel_lengths, audios):
+        rebuilt, _ = stft.stft_fn.transform(audio.unsqueeze(0))
+        convergence.append(spectral_convergence(
+            magnitude[None, :, :mel_length], rebuilt[:, :, :mel_length]))
+    return float(torch.cat(convergence).mean())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--wav', type=str, default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'demo.wav'))
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--iters', type=str, default='30,60')
+    parser.add_argument('--stft_backend', type=str, default='fft')
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    stft = TacotronSTFT(stft_backend=args.stft_backend)
+    wav, _ = librosa.load(args.wav, sr=stft.sampling_rate)
+    wav = torch.from_numpy(wav).float()
+
+    # slices from the full wav down to 3/4 of it, padded like a Tacotron2
+    # output batch
+    slices = [wav[:len(wav) * (4 * args.batch_size - i) // (4 * args.batch_size)]
+              for i in range(args.batch_size)]
+    with torch.no_grad():
+        mels = [stft.mel_spectrogram(x.unsqueeze(0)).squeeze(0) for x in slices]
+    mel_lengths = torch.LongTensor([mel.size(1) for mel in mels])
+    mel_padded = torch.zeros(len(mels), mels[0].size(0), int(mel_lengths.max()))
+    for i, mel in enumerate(mels):
+        mel_padded[i, :, :mel.size(1)] = mel
+    magnitudes = GriffinLim(stft).mel_to_magnitudes(mel_padded, mel_lengths)
+
+    for n_iters in [int(x) for x in args.iters.split(',')]:
+        torch.manual_seed(0)
+        start = time.perf_counter()
+        with torch.no_grad():
+            audios = [griffin_lim(magnitudes[i:i + 1, :, :mel_lengths[i]],
+                                  stft.stft_fn, n_iters).squeeze(0)
+                      for i in range(len(mels))]
+        print("{:3d} iters griffin_lim           {:6.2f} s  SC {:.4f}".format(
+            n_iters, time.perf_counter() - start,
+            mean_convergence(stft, magnitudes, mel_lengths, audios)))
+
+        for momentum, tol in ((0, 0), (0.99, 0), (0.99, 1e-3)):
+            vocoder = GriffinLim(stft, n_iters, momentum, tol)
+            generator = torch.Generator().manual_seed(0)
+            start = time.perf_counter()
+            with torch.no_grad():
+                _, ran = vocoder.phase_reconstruction(
+                    magnitudes, mel_lengths, generator)
+                audio, _ = vocoder(mel_padded, mel_lengths,
+                                   torch.Generator().manual_seed(0))
+            elapsed = (time.perf_counter() - start) / 2
+            print("{:3d} iters GriffinLim m={:4.2f} tol={:g} {:6.2f} s  SC {:.4f}"
+                  "  mean iters {:.1f}".format(
+                      n_iters, momentum, tol, elapsed,
+                      mean_convergence(stft, magnitudes, mel_lengths, audio),
+                      ran.float().mean()))
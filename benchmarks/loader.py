@@ -0,0 +1,48 @@
+""" TextMelLoader throughput in items/sec reading per-utterance files and
+reading a packed feature store built with feature_store.py
+
+python benchmarks/loader.py -f filelists/train.txt -s features/train
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from data_utils import TextMelLoader
+from hparams import create_hparams_from_json
+
+
+def items_per_second(loader, n_items, n_passes):
+    n_items = min(n_items, len(loader))
+    start = time.perf_counter()
+    for _ in range(n_passes):
+        for i in range(n_items):
+            loader[i]
+    return n_items * n_passes / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filelist', type=str, required=True)
+    parser.add_argument('-s', '--store_dir', type=str, required=True)
+    parser.add_argument('--config', type=str, default='config_sho.json')
+    parser.add_argument('--hparams', type=str, required=False,
+                        help='comma separated name=value pairs')
+    parser.add_argument('--n_items', type=int, default=1000)
+    parser.add_argument('--n_passes', type=int, default=1,
+                        help='passes after the first, which warms the caches')
+    args = parser.parse_args()
+
+    hparams = create_hparams_from_json(args.config, args.hparams)
+    results = []
+    for name, store_dir in (("files", ''), ("store", args.store_dir)):
+        hparams.feature_store = store_dir
+        loader = TextMelLoader(args.filelist, hparams)
+        items_per_second(loader, args.n_items, 1)
+        results.append((name, items_per_second(
+            loader, args.n_items, args.n_passes)))
+
+    for name, speed in results:
+        print("{:6s} {:10.1f} items/s {:6.2f}x".format(
+            name, speed, speed / results[0][1]))
@@ -0,0 +1,66 @@
+""" Latency of the mel projection (mel_spectrogram) and of its transpose
+(Griffin-Lim mel inversion) with the dense mel_basis and with the banded
+blocks of TacotronSTFT, at the shapes of one training item, an
+extract_mels batch and a training batch, with the largest difference
+between the two
+
+python benchmarks/mel_filterbank.py --threads 1
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from layers import TacotronSTFT
+
+
+def ms_per_call(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shapes', type=str, default='1x200,1x800,1x1500,16x600,64x800',
+                        help='comma separated batch x frames')
+    parser.add_argument('--mel_band_block', type=int, default=16)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    dense = TacotronSTFT(mel_band_block=0)
+    banded = TacotronSTFT(mel_band_block=args.mel_band_block)
+    n_freq = dense.mel_basis.size(1)
+    band_bins = sum((end - f) * (stop - start)
+                    for f, end, start, stop in banded.mel_blocks)
+    print("{} blocks of {} filters, {} of {} filterbank entries".format(
+        len(banded.mel_blocks), args.mel_band_block, band_bins,
+        dense.mel_basis.numel()))
+
+    print("{:>8s} {:>10s} {:>10s} {:>8s} {:>10s} {:>10s} {:>8s} {:>9s}".format(
+        'shape', 'dense', 'banded', 'speedup', 'dense T', 'banded T',
+        'speedup', 'max err'))
+    with torch.no_grad():
+        for shape in args.shapes.split(','):
+            batch_size, frames = (int(x) for x in shape.split('x'))
+            magnitudes = torch.rand(batch_size, n_freq, frames)
+            mels = torch.rand(batch_size, dense.n_mel_channels, frames)
+            err = max(
+                (dense.mel_project(magnitudes) -
+                 banded.mel_project(magnitudes)).abs().max().item(),
+                (dense.mel_transpose(mels) -
+                 banded.mel_transpose(mels)).abs().max().item())
+            times = [ms_per_call(lambda: fn(x), args.repeats) for fn, x in (
+                (dense.mel_project, magnitudes), (banded.mel_project, magnitudes),
+                (dense.mel_transpose, mels), (banded.mel_transpose, mels))]
+            print("{:>8s} {:8.2f}ms {:8.2f}ms {:7.1f}x {:8.2f}ms {:8.2f}ms "
+                  "{:7.1f}x {:9.1e}".format(
+                      shape, times[0], times[1], times[0] / times[1],
+                      times[2], times[3], times[2] / times[3], err))
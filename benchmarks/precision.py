@@ -0,0 +1,81 @@
+""" Accuracy and latency of fp32, bf16 and int8 CPU inference.
+
+Decodes the first utterances of a filelist at every precision with the same
+prenet dropout seed and reports the mel MSE of mel_outputs_postnet against
+fp32 over the frames both decodes produced, the mean difference in decoded
+length and the mean latency per utterance.
+
+python benchmarks/precision.py -c checkpoint --config config_sho.json
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from data_utils import TextMelLoader
+from export import load_inference_model
+from hparams import create_hparams_from_json
+from inference_precision import PRECISIONS, inference, prepare_inference_model
+
+
+def load_inputs(filelist, hparams, n_utterances):
+    loader = TextMelLoader(filelist, hparams)
+    inputs = []
+    for audiopath, text in loader.audiopaths_and_text[:n_utterances]:
+        text = loader.get_text(text).long().unsqueeze(0)
+        ed = loader.get_ed(audiopath).float().unsqueeze(0)
+        inputs.append((text, ed))
+    return inputs
+
+
+def run(model, inputs, precision, seed):
+    outputs, durations = [], []
+    for i, x in enumerate(inputs):
+        torch.manual_seed(seed + i)
+        start = time.perf_counter()
+        _, mel_outputs_postnet, _, _ = inference(model, x, precision)
+        durations.append(time.perf_counter() - start)
+        outputs.append(mel_outputs_postnet[0])
+    return outputs, sum(durations) / len(durations)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--checkpoint_path', type=str, required=True)
+    parser.add_argument('--config', type=str, default='config_sho.json')
+    parser.add_argument('--hparams', type=str, required=False,
+                        help='comma separated name=value pairs')
+    parser.add_argument('--filelist', type=str, default=None,
+                        help='defaults to the validation_files hparam')
+    parser.add_argument('--n_utterances', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--precisions', type=str, default=','.join(PRECISIONS))
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    hparams = create_hparams_from_json(args.config, args.hparams)
+    inputs = load_inputs(args.filelist or hparams.validation_files, hparams,
+                         args.n_utterances)
+    model = load_inference_model(args.checkpoint_path, hparams)
+
+    reference, reference_latency = run(model, inputs, 'fp32', args.seed)
+    print("{:6s} {:>10s} {:>8s} {:>12s} {:>10s}".format(
+        "", "ms/utt", "speedup", "mel MSE", "|dlen|"))
+    for precision in args.precisions.split(','):
+        prepared = prepare_inference_model(model, precision)
+        outputs, latency = run(prepared, inputs, precision, args.seed)
+        mse, length_difference = 0.0, 0.0
+        for output, target in zip(outputs, reference):
+            n_frames = min(output.size(1), target.size(1))
+            mse += torch.mean(
+                (output[:, :n_frames] - target[:, :n_frames]) ** 2).item()
+            length_difference += abs(output.size(1) - target.size(1))
+        print("{:6s} {:10.1f} {:8.2f} {:12.6f} {:10.1f}".format(
+            precision, latency * 1000, reference_latency / latency,
+            mse / len(outputs), length_difference / len(outputs)))
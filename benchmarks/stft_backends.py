@@ -0,0 +1,66 @@
+""" STFT.transform and STFT.inverse latency of the 'conv' and 'fft'
+backends across filter lengths and batch sizes, with the largest difference
+between the two in magnitudes and reconstructions
+
+python benchmarks/stft_backends.py --seconds 5 --threads 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from stft import STFT
+
+
+def ms_per_call(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filter_lengths', type=str, default='512,1024,2048')
+    parser.add_argument('--batch_sizes', type=str, default='1,8,32')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--sampling_rate', type=int, default=22050)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    n_samples = int(args.seconds * args.sampling_rate)
+
+    print("{:>6s} {:>5s} {:>10s} {:>10s} {:>7s} {:>10s} {:>10s} {:>7s} "
+          "{:>9s} {:>9s}".format(
+              "n_fft", "batch", "conv fwd", "fft fwd", "speedup", "conv inv",
+              "fft inv", "speedup", "mag err", "wav err"))
+    with torch.no_grad():
+        for filter_length in [int(x) for x in args.filter_lengths.split(',')]:
+            hop_length = filter_length // 4
+            conv = STFT(filter_length, hop_length, filter_length, backend='conv')
+            fft = STFT(filter_length, hop_length, filter_length, backend='fft')
+            for batch_size in [int(x) for x in args.batch_sizes.split(',')]:
+                x = torch.rand(batch_size, n_samples) * 2 - 1
+                magnitude, phase = conv.transform(x)
+                fft_magnitude, fft_phase = fft.transform(x)
+                mag_err = ((magnitude - fft_magnitude).abs().max() /
+                           magnitude.abs().max()).item()
+                wav_err = (conv.inverse(magnitude, phase) -
+                           fft.inverse(fft_magnitude, fft_phase)).abs().max().item()
+
+                times = [ms_per_call(lambda: stft.transform(x), args.repeats)
+                         for stft in (conv, fft)]
+                times += [ms_per_call(lambda: stft.inverse(magnitude, phase),
+                                      args.repeats) for stft in (conv, fft)]
+                print("{:6d} {:5d} {:8.2f}ms {:8.2f}ms {:6.1f}x {:8.2f}ms "
+                      "{:8.2f}ms {:6.1f}x {:9.1e} {:9.1e}".format(
+                          filter_length, batch_size, times[0], times[1],
+                          times[0] / times[1], times[2], times[3],
+                          times[2] / times[3], mag_err, wav_err))
@@ -1,10 +1,17 @@
+import math
+import queue
 import random
+import threading
+import time
 import numpy as np
 import torch
 import torch.utils.data
 import os
 
 import layers
+from feature_store import FeatureStore
+from length_index import LengthIndex, mel_length
+from text_cache import TextCache
 from text import text_to_sequence
 
 import sys
@@ -19,40 +26,81 @@ class TextMelLoader(torch.utils.data.Dataset):
         3) computes mel-spectrograms from audio files.
     """
     def __init__(self, audiopaths_and_text, hparams):
-        self.audiopaths_and_text = load_filepaths_and_text(audiopaths_and_text)
+        filelist = audiopaths_and_text
+        self.audiopaths_and_text = load_filepaths_and_text(filelist)
         self.text_cleaners = hparams.text_cleaners
         self.max_wav_value = hparams.max_wav_value
         self.sampling_rate = hparams.sampling_rate
         self.load_mel_from_disk = hparams.load_mel_from_disk
+        self.resample_wavs = hparams.resample_wavs
         self.stft = layers.TacotronSTFT(
             hparams.filter_length, hparams.hop_length, hparams.win_length,
             hparams.n_mel_channels, hparams.sampling_rate, hparams.mel_fmin,
             hparams.mel_fmax)
+        # shuffling the row numbers gives the same order as shuffling the
+        # list itself and keeps track of the text cache row of every item
         random.seed(hparams.seed)
-        random.shuffle(self.audiopaths_and_text)
+        self.text_rows = list(range(len(self.audiopaths_and_text)))
+        random.shuffle(self.text_rows)
+        self.audiopaths_and_text = [
+            self.audiopaths_and_text[i] for i in self.text_rows]
         self.Dataset_dir = hparams.Dataset_dir
         self.Feature_dir = hparams.Feature_dir
-        self.mel_mean_std = np.load(hparams.mel_mean_std)
+        self.mel_mean_std = np.load(hparams.mel_mean_std) \
+            if hparams.normalize_mel else None
         self.normalize_mel = hparams.normalize_mel
         self.blizzard_normalization = hparams.blizzard_normalization
+        self.feature_store = FeatureStore(hparams.feature_store) \
+            if hparams.feature_store else None
+        self.text_cache = TextCache(
+            filelist, self.text_cleaners, hparams.text_cache_dir) \
+            if hparams.text_cache_dir else None
+        self.length_index = LengthIndex(filelist, hparams) \
+            if hparams.length_index else None
+        if self.length_index is not None and hparams.filter_long_utterances:
+            self.filter_long_utterances(
+                hparams.max_decoder_steps * hparams.n_frames_per_step)
 
-    def get_mel_text_pair(self, audiopath_and_text):
+        # read plan: text and mel always, the optional per-item features only
+        # when the configured model consumes them, the rest stays None
+        self.optional_fields = [
+            ('ed', self.get_ed, hparams.include_ed),
+            ('sp', self.get_sp, hparams.load_sp),
+            ('word_dir', self.get_worddir, hparams.load_word_dir)]
+
+    def get_mel_text_pair(self, audiopath_and_text, index=None):
         # separate filename and text
         audiopath, text = audiopath_and_text[0], audiopath_and_text[1]
-        text = self.get_text(text)
+        if self.text_cache is not None and index is not None:
+            text = torch.from_numpy(
+                self.text_cache[self.text_rows[index]].astype(np.int32))
+        else:
+            text = self.get_text(text)
         mel = self.get_mel(audiopath)
-        ed = self.get_ed(audiopath)
-        sp = self.get_sp(audiopath)
-        word_dir = self.get_worddir(audiopath)
+        ed, sp, word_dir = [get(audiopath) if enabled else None
+                            for _, get, enabled in self.optional_fields]
         return (text, mel, ed, sp, word_dir)
 
     def get_mel(self, filename):
+        if self.feature_store is not None:
+            melspec = torch.from_numpy(self.feature_store.get(filename, 'mel'))
+            melspec = melspec.float()
+        else:
+            melspec = self.load_mel(filename)
+
+        if self.normalize_mel:
+            melspec = (melspec-self.mel_mean_std[0])/self.mel_mean_std[1]
+        return melspec
+
+    def load_mel(self, filename):
         filename = self.Dataset_dir + filename
         if not self.load_mel_from_disk:
-            audio, sampling_rate = load_wav_to_torch(filename)
+            audio, sampling_rate = load_wav_to_torch(
+                filename,
+                self.stft.sampling_rate if self.resample_wavs else None)
             if sampling_rate != self.stft.sampling_rate:
                 raise ValueError("{} {} SR doesn't match target {} SR".format(
-                    sampling_rate, self.stft.sampling_rate))
+                    filename, sampling_rate, self.stft.sampling_rate))
             audio_norm = audio / self.max_wav_value
             audio_norm = audio_norm.unsqueeze(0)
             audio_norm = torch.autograd.Variable(audio_norm, requires_grad=False)
@@ -63,96 +111,309 @@ class TextMelLoader(torch.utils.data.Dataset):
             assert melspec.size(0) == self.stft.n_mel_channels, (
                 'Mel dimension mismatch: given {}, expected {}'.format(
                     melspec.size(0), self.stft.n_mel_channels))
-
-        if self.normalize_mel:
-            melspec = (melspec-self.mel_mean_std[0])/self.mel_mean_std[1]
         return melspec
 
+    def filter_long_utterances(self, max_mel_frames):
+        """Drops the items with more mel frames than the decoder runs for,
+        using the length index"""
+        mel_frames = self.length_index.lengths['mel_frames'][self.text_rows]
+        keep = np.flatnonzero(mel_frames <= max_mel_frames)
+        if len(keep) < len(self.text_rows):
+            print("Dropped {} of {} utterances above {} mel frames".format(
+                len(self.text_rows) - len(keep), len(self.text_rows),
+                max_mel_frames))
+        self.text_rows = [self.text_rows[i] for i in keep]
+        self.audiopaths_and_text = [self.audiopaths_and_text[i] for i in keep]
+
+    def get_mel_length(self, filename):
+        """Number of mel frames of an item, read from array headers
+        without loading the features"""
+        if self.feature_store is not None:
+            return self.feature_store.shape(filename, 'mel')[1]
+        return mel_length(self.Dataset_dir + filename, self.load_mel_from_disk,
+                          self.stft.stft_fn.hop_length,
+                          self.stft.sampling_rate if self.resample_wavs else None)
+
+    def get_mel_lengths(self):
+        if self.length_index is not None:
+            return self.length_index.lengths['mel_frames'][self.text_rows].tolist()
+        return [self.get_mel_length(x[0]) for x in self.audiopaths_and_text]
+
     def get_text(self, text):
         text_norm = torch.IntTensor(text_to_sequence(text, self.text_cleaners))
         return text_norm
     
+    def feature_path(self, filename, suffix):
+        return self.Dataset_dir + ".".join(filename.split(".")[:-1]) + suffix
+
+    def worddir_path(self, filename):
+        return self.Feature_dir + filename.split("/")[-2] + "/" + ".".join(os.path.basename(filename).split(".")[:-1]) + "_words_phones_dir.npy"
+
     def get_ed(self, filename):
-        if self.blizzard_normalization:
-            filename = ".".join(filename.split(".")[:-1]) + "_EI.npy"
-        else:
-            filename = ".".join(filename.split(".")[:-1]) + "_ED.npy"
-        filename = self.Dataset_dir + filename
-        ed = torch.from_numpy(np.load(filename))
+        field = "EI" if self.blizzard_normalization else "ED"
+        if self.feature_store is not None:
+            return torch.from_numpy(self.feature_store.get(filename, field))
+        ed = torch.from_numpy(np.load(self.feature_path(filename, "_{}.npy".format(field))))
         return ed
     
     def get_sp(self, filename):
-        filename = ".".join(filename.split(".")[:-1]) + "_SP.npy"
-        filename = self.Dataset_dir + filename
-        ed = torch.from_numpy(np.load(filename))
+        if self.feature_store is not None:
+            return torch.from_numpy(self.feature_store.get(filename, "SP"))
+        ed = torch.from_numpy(np.load(self.feature_path(filename, "_SP.npy")))
         return ed
     
     def get_worddir(self, filename):
-        return np.load(self.Feature_dir + filename.split("/")[-2] + "/" + ".".join(os.path.basename(filename).split(".")[:-1]) + "_words_phones_dir.npy", allow_pickle=True).item()
+        if self.feature_store is not None:
+            return self.feature_store.get_object(filename, "word_dir")
+        return np.load(self.worddir_path(filename), allow_pickle=True).item()
 
     def __getitem__(self, index):
-        return self.get_mel_text_pair(self.audiopaths_and_text[index])
+        return self.get_mel_text_pair(self.audiopaths_and_text[index], index)
 
     def __len__(self):
         return len(self.audiopaths_and_text)
 
 
+class BucketBatchSampler(torch.utils.data.Sampler):
+    """ Batches items of similar mel length to reduce padding
+
+    Every epoch the items are sorted by length with random tie breaking, cut
+    into buckets of bucket_batches * batch_size neighbours, shuffled inside
+    each bucket and batched, and the batches are shuffled across buckets.
+    Like DistributedSampler, every replica builds the same batches from the
+    same seed and epoch and keeps every num_replicas-th one, wrapping around
+    so all replicas get the same number of batches. Call set_epoch before
+    each epoch.
+    """
+    def __init__(self, lengths, batch_size, bucket_batches=32,
+                 num_replicas=1, rank=0, shuffle=True, seed=0,
+                 drop_last=True):
+        self.lengths = torch.as_tensor(lengths)
+        self.batch_size = batch_size
+        self.bucket_size = batch_size * max(bucket_batches, 1)
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+
+        n_batches = len(self.lengths) // batch_size
+        if not drop_last and len(self.lengths) % batch_size:
+            n_batches += 1
+        self.num_batches = math.ceil(n_batches / num_replicas)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def batches(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+
+        if self.shuffle:
+            permutation = torch.randperm(len(self.lengths), generator=generator)
+            order = permutation[torch.sort(
+                self.lengths[permutation], stable=True)[1]]
+        else:
+            order = torch.sort(self.lengths, stable=True)[1]
+
+        batches = []
+        for start in range(0, len(order), self.bucket_size):
+            bucket = order[start:start + self.bucket_size]
+            if self.shuffle:
+                bucket = bucket[torch.randperm(len(bucket), generator=generator)]
+            batches += list(torch.split(bucket, self.batch_size))
+
+        # only the last bucket can end in a short batch
+        if len(batches[-1]) < self.batch_size and self.drop_last:
+            batches = batches[:-1]
+        if self.shuffle:
+            batches = [batches[i] for i in
+                       torch.randperm(len(batches), generator=generator)]
+
+        total = self.num_batches * self.num_replicas
+        batches += batches[:total - len(batches)]
+        return [batch.tolist() for batch in batches[self.rank:total:self.num_replicas]]
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def __len__(self):
+        return self.num_batches
+
+
 class TextMelCollate():
     """ Zero-pads model inputs and targets based on number of frames per setep
+    PARAMS
+    ------
+    n_frames_per_step: decoder frames per step, mels are padded to a multiple
+    ed_bool_list: emotion intensity channels to keep, the phones_words_utterance
+        selection repeated 4 times. None keeps all 12 channels
+    pin_memory: allocate the batch in pinned memory when collating in the
+        main process. Batches collated in DataLoader workers are allocated
+        in shared memory instead, so they are not copied again when sent to
+        the main process
     """
-    def __init__(self, n_frames_per_step):
+    def __init__(self, n_frames_per_step, ed_bool_list=None, pin_memory=False):
         self.n_frames_per_step = n_frames_per_step
+        self.ed_index = None if ed_bool_list is None else \
+            torch.from_numpy(np.flatnonzero(ed_bool_list))
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+
+    def new_empty(self, size, dtype=torch.float):
+        if torch.utils.data.get_worker_info() is not None:
+            return torch.empty(size, dtype=dtype).share_memory_()
+        return torch.empty(size, dtype=dtype, pin_memory=self.pin_memory)
+
+    def new_zeros(self, size, dtype=torch.float):
+        return self.new_empty(size, dtype).zero_()
 
     def __call__(self, batch):
         """Collate's training batch from normalized text and mel-spectrogram
         PARAMS
         ------
-        batch: [text_normalized, mel_normalized]
+        batch: [text_normalized, mel_normalized, ed, sp, word_dir]
         """
-        # Right zero-pad all one-hot text sequences to max input length
         input_lengths, ids_sorted_decreasing = torch.sort(
             torch.LongTensor([len(x[0]) for x in batch]),
             dim=0, descending=True)
-        max_input_len = input_lengths[0]
+        max_input_len = int(input_lengths[0])
+        ids_sorted_decreasing = ids_sorted_decreasing.tolist()
 
-        text_padded = torch.LongTensor(len(batch), max_input_len)
-        text_padded.zero_()
-        for i in range(len(ids_sorted_decreasing)):
-            text = batch[ids_sorted_decreasing[i]][0]
-            text_padded[i, :text.size(0)] = text
-
-        # Right zero-pad mel-spec
         num_mels = batch[0][1].size(0)
-        max_target_len = max([x[1].size(1) for x in batch])
+        output_lengths = torch.LongTensor(
+            [batch[i][1].size(1) for i in ids_sorted_decreasing])
+        max_target_len = int(output_lengths.max())
         if max_target_len % self.n_frames_per_step != 0:
             max_target_len += self.n_frames_per_step - max_target_len % self.n_frames_per_step
             assert max_target_len % self.n_frames_per_step == 0
+        n_ed = 12 if self.ed_index is None else len(self.ed_index)
+
+        B = len(batch)
+        text_padded = self.new_zeros((B, max_input_len), torch.long)
+        # the mel is the bulk of the batch, only its padding is zeroed
+        mel_padded = self.new_empty((B, num_mels, max_target_len))
+        gate_padded = self.new_zeros((B, max_target_len))
+        ed_padded = self.new_zeros((B, n_ed, max_input_len))
+        sp_padded = self.new_zeros((B, 3, max_input_len))
 
-        # include mel padded and gate padded
-        mel_padded = torch.FloatTensor(len(batch), num_mels, max_target_len)
-        mel_padded.zero_()
-        gate_padded = torch.FloatTensor(len(batch), max_target_len)
-        gate_padded.zero_()
-        output_lengths = torch.LongTensor(len(batch))
-        for i in range(len(ids_sorted_decreasing)):
-            mel = batch[ids_sorted_decreasing[i]][1]
+        # one pass over the batch for every input and target
+        for i, j in enumerate(ids_sorted_decreasing):
+            text, mel, ed, sp = batch[j][:4]
+            text_padded[i, :text.size(0)] = text
             mel_padded[i, :, :mel.size(1)] = mel
-            gate_padded[i, mel.size(1)-1:] = 1
-            output_lengths[i] = mel.size(1)
-        
-        # Emotion Intensity
-        ed_padded = torch.FloatTensor(len(batch), 12, max_input_len)
-        ed_padded.zero_()
-        for i in range(len(ids_sorted_decreasing)):
-            ed = batch[ids_sorted_decreasing[i]][2]
-            ed_padded[i, :, :ed.size(1)] = ed
-            
-        # Symbol Position
-        sp_padded = torch.FloatTensor(len(batch), 3, max_input_len)
-        sp_padded.zero_()
-        for i in range(len(ids_sorted_decreasing)):
-            sp = batch[ids_sorted_decreasing[i]][3]
-            sp_padded[i, :, :sp.size(1)] = sp
+            mel_padded[i, :, mel.size(1):] = 0
+            # fields the loader skipped stay zero
+            if ed is not None:
+                if self.ed_index is not None:
+                    ed = ed[self.ed_index]
+                ed_padded[i, :, :ed.size(1)] = ed
+            if sp is not None:
+                sp_padded[i, :, :sp.size(1)] = sp
+
+        # gate target is 1 from the last real frame on
+        gate_padded.copy_(torch.arange(max_target_len).unsqueeze(0) >=
+                          (output_lengths - 1).unsqueeze(1))
+        if self.pin_memory and torch.utils.data.get_worker_info() is None:
+            input_lengths = input_lengths.pin_memory()
+            output_lengths = output_lengths.pin_memory()
 
         return text_padded, input_lengths, mel_padded, gate_padded, \
             output_lengths, ed_padded, sp_padded
+
+
+class BatchPrefetcher():
+    """ Iterates over a DataLoader and runs parse_batch on the next batches
+    in a background thread, on a separate CUDA stream when CUDA is
+    available, so the host to device copies and dtype casts overlap with the
+    current training step. depth is the number of parsed batches kept ready,
+    0 parses in the calling thread. wait_time holds the seconds the last
+    step spent waiting for its batch.
+    """
+    def __init__(self, loader, parse_batch, depth=2):
+        self.loader = loader
+        self.parse_batch = parse_batch
+        self.depth = depth
+        self.wait_time = 0.0
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _tensors(self, parsed):
+        for x in parsed:
+            if isinstance(x, (tuple, list)):
+                for t in self._tensors(x):
+                    yield t
+            elif torch.is_tensor(x):
+                yield x
+
+    def _put(self, batches, item, stop):
+        # gives up once the consumer has stopped, it would never take the item
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, batches, stream, stop):
+        try:
+            for batch in self.loader:
+                if stream is None:
+                    item = (self.parse_batch(batch), None)
+                else:
+                    with torch.cuda.stream(stream):
+                        parsed = self.parse_batch(batch)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                    item = (parsed, event)
+                if not self._put(batches, item, stop):
+                    return
+        except Exception as e:
+            if not self._put(batches, e, stop):
+                return
+        self._put(batches, None, stop)
+
+    def __iter__(self):
+        if self.depth == 0:
+            iterator = iter(self.loader)
+            while True:
+                start = time.perf_counter()
+                batch = next(iterator, None)
+                if batch is None:
+                    return
+                parsed = self.parse_batch(batch)
+                self.wait_time = time.perf_counter() - start
+                yield parsed
+
+        stream = torch.cuda.Stream() if torch.cuda.is_available() else None
+        batches = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce,
+                                  args=(batches, stream, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                item = batches.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                parsed, event = item
+                if event is not None:
+                    # the step must not start before the copies are done and
+                    # the allocator must not reuse their memory while the
+                    # step runs
+                    current_stream = torch.cuda.current_stream()
+                    current_stream.wait_event(event)
+                    for t in self._tensors(parsed):
+                        t.record_stream(current_stream)
+                self.wait_time = time.perf_counter() - start
+                yield parsed
+        finally:
+            # a consumer leaving early, by break, an exception or closing the
+            # generator, releases the thread and with it the loader workers
+            stop.set()
+            thread.join()
@@ -0,0 +1,44 @@
+import argparse
+
+import torch
+
+from hparams import create_hparams_from_json
+from model import Tacotron2
+from model_jit import script_model
+
+
+def load_inference_model(checkpoint_path, hparams):
+    model = Tacotron2(hparams)
+    checkpoint_dict = torch.load(checkpoint_path, map_location='cpu')
+    model.load_state_dict(checkpoint_dict['state_dict'])
+    return model.eval()
+
+
+def export(checkpoint_path, output_path, hparams):
+    """Scripts the inference graph of a checkpoint and saves it as a
+    standalone TorchScript artifact, loadable with torch.jit.load and called
+    as mel_outputs, mel_outputs_postnet, alignments, mel_lengths =
+    module(text_padded, ed_padded, input_lengths)"""
+    model = load_inference_model(checkpoint_path, hparams)
+    scripted = script_model(model)
+    scripted.save(output_path)
+    print("Exported '{}' to '{}'".format(checkpoint_path, output_path))
+    return scripted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--checkpoint_path', type=str, required=True,
+                        help='checkpoint path')
+    parser.add_argument('-o', '--output_path', type=str,
+                        default='tacotron2_jit.pt',
+                        help='path of the TorchScript artifact')
+    parser.add_argument('--config', type=str, default='config_sho.json',
+                        help='json config the checkpoint was trained with')
+    parser.add_argument('--hparams', type=str,
+                        required=False, help='comma separated name=value pairs')
+
+    args = parser.parse_args()
+    hparams = create_hparams_from_json(args.config, args.hparams)
+
+    export(args.checkpoint_path, args.output_path, hparams)
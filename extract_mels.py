@@ -0,0 +1,187 @@
+""" Offline mel-spectrogram extraction for load_mel_from_disk=True
+
+Reads a filelist of wavs, computes the mels with TacotronSTFT in batches
+across a process pool and saves each one as a .npy next to where
+TextMelLoader looks for it: output_dir + the wav path with a .npy extension,
+output_dir defaulting to Dataset_dir so the mels sit beside the _ED/_SP
+files. Finished items are skipped, so an interrupted run resumes where it
+stopped. Recordings longer than --stream_seconds are read through a memory
+map and extracted block by block with TacotronSTFT.mel_spectrogram_stream
+straight into the .npy, so hour-long sources need no more memory than a
+block. With resample_wavs, wavs at another rate are resampled the way
+TextMelLoader does before the mel is taken; a resampled recording is held
+in memory whole.
+
+python extract_mels.py -f filelists/train.txt --output_filelist filelists/train_mel.txt
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import torch
+from scipy.io.wavfile import read
+
+from hparams import create_hparams_from_json
+from layers import TacotronSTFT
+from utils import load_filepaths_and_text, resample
+
+_stft = None
+_max_wav_value = None
+_stream_samples = None
+_resample_wavs = None
+
+
+def mel_path(audiopath):
+    return ".".join(audiopath.split(".")[:-1]) + ".npy"
+
+
+def batch_mel_spectrogram(stft, audios):
+    """ Mels of several waves of different lengths with one
+    TacotronSTFT.mel_spectrogram call. Every wave gets its own reflect
+    padding before the batch is zero-padded, so each mel matches what
+    mel_spectrogram returns for that wave alone.
+    PARAMS
+    ------
+    audios: list of 1-D FloatTensors in range [-1, 1]
+
+    RETURNS
+    -------
+    list of (n_mel_channels, n_samples // hop_length + 1) mels
+    """
+    pad = stft.stft_fn.filter_length // 2
+    rows = [torch.cat((audio, audio.flip(0)[1:pad + 1])) for audio in audios]
+    batch = torch.zeros(len(rows), max(row.size(0) for row in rows))
+    for i, row in enumerate(rows):
+        batch[i, :row.size(0)] = row
+    mels = stft.mel_spectrogram(batch)
+    return [mels[i, :, :audio.size(0) // stft.stft_fn.hop_length + 1]
+            for i, audio in enumerate(audios)]
+
+
+def stream_mel_to_file(stft, data, max_wav_value, output_path,
+                        block_samples=1 << 20):
+    """ Writes the mel of a 1-D int or float array of samples, typically a
+    memory map, to a .npy block by block """
+    n_frames = len(data) // stft.stft_fn.hop_length + 1
+    blocks = (torch.from_numpy(
+        data[i:i + block_samples].astype(np.float32)).unsqueeze(0) / max_wav_value
+        for i in range(0, len(data), block_samples))
+
+    # write then rename, a crash never leaves a truncated mel behind
+    mel = np.lib.format.open_memmap(
+        output_path + '.tmp', mode='w+', dtype=np.float32,
+        shape=(stft.n_mel_channels, n_frames))
+    frame = 0
+    with torch.no_grad():
+        for block in stft.mel_spectrogram_stream(blocks):
+            mel[:, frame:frame + block.size(2)] = block[0].numpy()
+            frame += block.size(2)
+    mel.flush()
+    del mel
+    os.replace(output_path + '.tmp', output_path)
+
+
+def _init_worker(stft_args, max_wav_value, stream_samples, resample_wavs):
+    global _stft, _max_wav_value, _stream_samples, _resample_wavs
+    # one process per core, intra-op threads would only contend
+    torch.set_num_threads(1)
+    _stft = TacotronSTFT(*stft_args)
+    _max_wav_value = max_wav_value
+    _stream_samples = stream_samples
+    _resample_wavs = resample_wavs
+
+
+def _extract_batch(items):
+    audios, batch_items = [], []
+    n_samples = 0
+    for audiopath, output_path in items:
+        sampling_rate, data = read(audiopath, mmap=True)
+        if sampling_rate != _stft.sampling_rate:
+            if not _resample_wavs:
+                raise ValueError("{} {} SR doesn't match target {} SR".format(
+                    audiopath, sampling_rate, _stft.sampling_rate))
+            data = resample(data.astype(np.float32), sampling_rate,
+                            _stft.sampling_rate)
+        n_samples += len(data)
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        if len(data) > _stream_samples:
+            stream_mel_to_file(_stft, data, _max_wav_value, output_path)
+            continue
+        audios.append(torch.from_numpy(data.astype(np.float32)) / _max_wav_value)
+        batch_items.append(output_path)
+
+    with torch.no_grad():
+        mels = batch_mel_spectrogram(_stft, audios) if audios else []
+    for output_path, mel in zip(batch_items, mels):
+        # write then rename, a crash never leaves a truncated mel behind
+        with open(output_path + '.tmp', 'wb') as f:
+            np.save(f, mel.numpy())
+        os.replace(output_path + '.tmp', output_path)
+    return len(items), n_samples
+
+
+def extract_mels(filelist, hparams, output_dir=None, output_filelist=None,
+                 n_workers=None, batch_size=16, stream_seconds=60.0):
+    dataset_dir = hparams.Dataset_dir
+    output_dir = dataset_dir if output_dir is None else output_dir
+    audiopaths_and_text = load_filepaths_and_text(filelist)
+
+    todo = []
+    for audiopath, _ in audiopaths_and_text:
+        output_path = output_dir + mel_path(audiopath)
+        if not os.path.exists(output_path):
+            todo.append((dataset_dir + audiopath, output_path))
+    print("{} of {} items to extract".format(
+        len(todo), len(audiopaths_and_text)))
+
+    # similar lengths in a batch keep the zero padding small
+    todo.sort(key=lambda item: os.path.getsize(item[0]))
+    batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+    stft_args = (hparams.filter_length, hparams.hop_length, hparams.win_length,
+                 hparams.n_mel_channels, hparams.sampling_rate,
+                 hparams.mel_fmin, hparams.mel_fmax)
+    stream_samples = int(stream_seconds * hparams.sampling_rate)
+
+    n_items, n_samples = 0, 0
+    start = time.perf_counter()
+    with multiprocessing.Pool(n_workers, _init_worker,
+                              (stft_args, hparams.max_wav_value,
+                               stream_samples, hparams.resample_wavs)) as pool:
+        for batch_items, batch_samples in pool.imap_unordered(
+                _extract_batch, batches):
+            n_items += batch_items
+            n_samples += batch_samples
+            if n_items % 1000 < batch_items or n_items == len(todo):
+                duration = time.perf_counter() - start
+                print("{}/{} items, {:.1f} items/s, {:.0f}x real time".format(
+                    n_items, len(todo), n_items / duration,
+                    n_samples / hparams.sampling_rate / duration))
+
+    if output_filelist is not None:
+        with open(output_filelist, 'w', encoding='utf-8') as f:
+            for audiopath, text in audiopaths_and_text:
+                f.write("{}|{}\n".format(mel_path(audiopath), text))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filelist', type=str, required=True)
+    parser.add_argument('-o', '--output_dir', type=str, default=None,
+                        help='defaults to the Dataset_dir hparam')
+    parser.add_argument('--output_filelist', type=str, default=None,
+                        help='filelist of the .npy mels to train from')
+    parser.add_argument('--config', type=str, default='config_sho.json')
+    parser.add_argument('--hparams', type=str, required=False,
+                        help='comma separated name=value pairs')
+    parser.add_argument('--n_workers', type=int, default=None,
+                        help='defaults to the number of cores')
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--stream_seconds', type=float, default=60.0,
+                        help='recordings longer than this are streamed')
+    args = parser.parse_args()
+
+    hparams = create_hparams_from_json(args.config, args.hparams)
+    extract_mels(args.filelist, hparams, args.output_dir, args.output_filelist,
+                 args.n_workers, args.batch_size, args.stream_seconds)
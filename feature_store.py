@@ -0,0 +1,162 @@
+""" Packs the per-utterance feature files of a filelist into a few large shards
+
+Every utterance normally needs up to four small files (mel, _ED/_EI, _SP and
+the pickled _words_phones_dir), which is slow on network storage. The packed
+store keeps the raw arrays back to back in shard files and an index.json
+mapping each filelist path to (shard, offset, shape, dtype) per field.
+TextMelLoader reads it through np.memmap when the feature_store hparam
+points at the store directory.
+
+python feature_store.py -f filelists/train.txt -o features/train --mel_fp16
+"""
+import argparse
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+
+from utils import load_filepaths_and_text
+
+ALIGNMENT = 64
+ED_FIELDS = ('ED', 'EI', 'SP')
+
+
+class FeatureStore(object):
+    """ Read side of a packed store, shards are memory-mapped on first use
+    and returned arrays are zero-copy views into them """
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, 'index.json')) as f:
+            index = json.load(f)
+        self.store_dir = store_dir
+        self.shard_names = index['shards']
+        self.items = index['items']
+        self.shards = [None] * len(self.shard_names)
+
+    def __getstate__(self):
+        # DataLoader workers map the shards themselves instead of pickling them
+        state = self.__dict__.copy()
+        state['shards'] = [None] * len(self.shard_names)
+        return state
+
+    def __contains__(self, audiopath):
+        return audiopath in self.items
+
+    def has(self, audiopath, field):
+        return field in self.items.get(audiopath, {})
+
+    def _shard(self, i):
+        if self.shards[i] is None:
+            # copy-on-write so torch.from_numpy gets a writable array
+            self.shards[i] = np.memmap(
+                os.path.join(self.store_dir, self.shard_names[i]),
+                dtype=np.uint8, mode='c')
+        return self.shards[i]
+
+    def shape(self, audiopath, field):
+        return self.items[audiopath][field][2]
+
+    def get(self, audiopath, field):
+        shard, offset, shape, dtype = self.items[audiopath][field]
+        count = int(np.prod(shape))
+        return np.frombuffer(self._shard(shard), dtype=np.dtype(dtype),
+                             count=count, offset=offset).reshape(shape)
+
+    def get_object(self, audiopath, field):
+        return pickle.loads(self.get(audiopath, field).tobytes())
+
+
+class FeatureStoreWriter(object):
+    def __init__(self, store_dir, shard_bytes=1 << 30):
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.shard_bytes = shard_bytes
+        self.shard_names = []
+        self.items = {}
+        self.shard = None
+        self.offset = 0
+
+    def _next_shard(self):
+        if self.shard is not None:
+            self.shard.close()
+        self.shard_names.append('shard_{:04d}.bin'.format(len(self.shard_names)))
+        self.shard = open(os.path.join(self.store_dir, self.shard_names[-1]), 'wb')
+        self.offset = 0
+
+    def add(self, audiopath, arrays):
+        size = sum(array.nbytes + ALIGNMENT for array in arrays.values())
+        if self.shard is None or (self.offset > 0 and
+                                  self.offset + size > self.shard_bytes):
+            self._next_shard()
+
+        entry = {}
+        for field, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            padding = -self.offset % ALIGNMENT
+            self.shard.write(b'\0' * padding)
+            self.offset += padding
+            entry[field] = [len(self.shard_names) - 1, self.offset,
+                            list(array.shape), array.dtype.str]
+            self.shard.write(array.tobytes())
+            self.offset += array.nbytes
+        self.items[audiopath] = entry
+
+    def close(self):
+        if self.shard is not None:
+            self.shard.close()
+        with open(os.path.join(self.store_dir, 'index.json'), 'w') as f:
+            json.dump({'shards': self.shard_names, 'items': self.items}, f)
+
+
+def load_arrays(loader, audiopath, mel_dtype=np.float32):
+    """ Raw arrays of one utterance, mels are stored before normalization """
+    arrays = {'mel': loader.load_mel(audiopath).numpy().astype(mel_dtype)}
+    for field in ED_FIELDS:
+        path = loader.feature_path(audiopath, '_{}.npy'.format(field))
+        if os.path.exists(path):
+            arrays[field] = np.load(path)
+    path = loader.worddir_path(audiopath)
+    if os.path.exists(path):
+        word_dir = np.load(path, allow_pickle=True).item()
+        arrays['word_dir'] = np.frombuffer(pickle.dumps(word_dir), np.uint8)
+    return arrays
+
+
+def pack_features(audiopaths_and_text, hparams, store_dir,
+                  shard_bytes=1 << 30, mel_dtype=np.float32):
+    from data_utils import TextMelLoader
+
+    loader = TextMelLoader(audiopaths_and_text, hparams)
+    writer = FeatureStoreWriter(store_dir, shard_bytes)
+    start = time.perf_counter()
+    # every line of the filelist, including the ones the loader filters out
+    for i, (audiopath, _) in enumerate(
+            load_filepaths_and_text(audiopaths_and_text)):
+        writer.add(audiopath, load_arrays(loader, audiopath, mel_dtype))
+        if (i + 1) % 1000 == 0:
+            print("{} items, {:.1f} items/s".format(
+                i + 1, (i + 1) / (time.perf_counter() - start)))
+    writer.close()
+    print("Packed {} items into {} shards in '{}'".format(
+        len(writer.items), len(writer.shard_names), store_dir))
+
+
+if __name__ == '__main__':
+    from hparams import create_hparams_from_json
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filelist', type=str, required=True)
+    parser.add_argument('-o', '--store_dir', type=str, required=True)
+    parser.add_argument('--config', type=str, default='config_sho.json')
+    parser.add_argument('--hparams', type=str, required=False,
+                        help='comma separated name=value pairs')
+    parser.add_argument('--shard_mb', type=int, default=1024)
+    parser.add_argument('--mel_fp16', action='store_true',
+                        help='store mels as float16')
+    args = parser.parse_args()
+
+    hparams = create_hparams_from_json(args.config, args.hparams)
+    pack_features(args.filelist, hparams, args.store_dir,
+                  shard_bytes=args.shard_mb << 20,
+                  mel_dtype=np.float16 if args.mel_fp16 else np.float32)
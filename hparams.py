@@ -1,11 +1,40 @@
-import tensorflow as tf
+import ast
+import json
+import re
 from text import symbols
 
 
-def create_hparams(hparams_string=None, verbose=False):
-    """Create model hyperparameters. Parse nondefault from given string."""
+class HParams(dict):
+    """Hyperparameters readable both as attributes and as items, which is
+    how the model and data modules access them"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def parse(self, hparams_string):
+        """Overrides values from a comma separated list of name=value pairs"""
+        for pair in re.split(r',(?=\s*\w+\s*=)', hparams_string):
+            name, value = [x.strip() for x in pair.split('=', 1)]
+            if name not in self:
+                raise ValueError('Unknown hparam: {}'.format(name))
+            try:
+                value = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                pass
+            self[name] = value
+        return self
+
 
-    hparams = tf.contrib.training.HParams(
+def default_hparams():
+    """Default hyperparameters as a plain dict"""
+
+    return dict(
         ################################
         # Experiment Parameters        #
         ################################
@@ -25,9 +54,25 @@ def create_hparams(hparams_string=None, verbose=False):
         # Data Parameters             #
         ################################
         load_mel_from_disk=False,
+        resample_wavs=False,
         training_files='filelists/ljs_audio_text_train_filelist.txt',
         validation_files='filelists/ljs_audio_text_val_filelist.txt',
         text_cleaners=['english_cleaners'],
+        Dataset_dir='',
+        Feature_dir='',
+        normalize_mel=False,
+        mel_mean_std=None,
+        blizzard_normalization=False,
+        load_sp=False,  # _SP.npy symbol positions, no model consumes them yet
+        load_word_dir=False,  # pickled _words_phones_dir.npy dictionaries
+        text_cache_dir='.text_cache',  # tokenized filelists, '' to disable
+        feature_store='',  # packed store directory, see feature_store.py
+        length_index=True,  # <filelist>.lengths.npz sidecar, see length_index.py
+        filter_long_utterances=True,  # drop items above max_decoder_steps
+        num_workers=1,  # DataLoader worker processes
+        prefetch_factor=2,  # batches loaded in advance by each worker
+        persistent_workers=False,  # keep workers alive between epochs
+        prefetch_batches=2,  # batches parsed onto the device ahead, 0 to disable
 
         ################################
         # Audio Parameters             #
@@ -47,6 +92,12 @@ def create_hparams(hparams_string=None, verbose=False):
         n_symbols=len(symbols),
         symbols_embedding_dim=512,
 
+        # Emotion intensity conditioning
+        include_ed=False,
+        combination="addition",
+        concatenation_embedding=False,
+        phones_words_utterance=[True, True, True],
+
         # Encoder parameters
         encoder_kernel_size=5,
         encoder_n_convolutions=3,
@@ -60,6 +111,7 @@ def create_hparams(hparams_string=None, verbose=False):
         gate_threshold=0.5,
         p_attention_dropout=0.1,
         p_decoder_dropout=0.1,
+        decoder_workspace=True,  # preallocated buffers in Decoder.inference
 
         # Attention parameters
         attention_rnn_dim=1024,
@@ -69,6 +121,12 @@ def create_hparams(hparams_string=None, verbose=False):
         attention_location_n_filters=32,
         attention_location_kernel_size=31,
 
+        # Windowed attention around the previous attention peak
+        attention_window_training=False,
+        attention_window_inference=False,
+        attention_window_backward=5,
+        attention_window_forward=15,
+
         # Mel-post processing network parameters
         postnet_embedding_dim=512,
         postnet_kernel_size=5,
@@ -82,9 +140,17 @@ def create_hparams(hparams_string=None, verbose=False):
         weight_decay=1e-6,
         grad_clip_thresh=1.0,
         batch_size=64,
+        bucket_batches=32,  # batches per length bucket, 0 to disable bucketing
         mask_padding=True  # set model's padded outputs to padded values
     )
 
+
+def create_hparams(hparams_string=None, verbose=False):
+    """Create model hyperparameters. Parse nondefault from given string."""
+    import tensorflow as tf
+
+    hparams = tf.contrib.training.HParams(**default_hparams())
+
     if hparams_string:
         tf.logging.info('Parsing command line hparams: %s', hparams_string)
         hparams.parse(hparams_string)
@@ -93,3 +159,22 @@ def create_hparams(hparams_string=None, verbose=False):
         tf.logging.info('Final parsed hparams: %s', hparams.values())
 
     return hparams
+
+
+def create_hparams_from_json(config_path, hparams_string=None):
+    """Create hyperparameters from a json config such as config_sho.json.
+    Keys missing from the config keep their default value and "True"/"False"
+    strings are read as booleans."""
+    with open(config_path) as f:
+        config = json.load(f)
+
+    hparams = HParams(default_hparams())
+    for name, value in config.items():
+        if value in ("True", "False"):
+            value = value == "True"
+        hparams[name] = value
+
+    if hparams_string:
+        hparams.parse(hparams_string)
+
+    return hparams
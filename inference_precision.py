@@ -0,0 +1,42 @@
+import contextlib
+
+import torch
+from torch import nn
+
+
+PRECISIONS = ('fp32', 'bf16', 'int8')
+
+
+def prepare_inference_model(model, precision='fp32'):
+    """Returns an eval-mode model to run on CPU at the given precision.
+
+    PARAMS
+    ------
+    model: Tacotron2
+    precision: 'fp32', 'bf16' (autocast, see precision_context) or 'int8',
+        which returns a copy with the decoder LSTMCells and every Linear
+        dynamically quantized to int8
+    """
+    if precision not in PRECISIONS:
+        raise ValueError("precision should be one of {}, got '{}'".format(
+            PRECISIONS, precision))
+    model = model.eval()
+    if precision == 'int8':
+        model = torch.quantization.quantize_dynamic(
+            model, {nn.LSTMCell, nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def precision_context(precision='fp32'):
+    """Context manager the inference call has to run under"""
+    if precision == 'bf16':
+        return torch.autocast('cpu', dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def inference(model, inputs, precision='fp32'):
+    """Tacotron2.inference of a model returned by prepare_inference_model,
+    with the outputs cast back to float32"""
+    with torch.no_grad(), precision_context(precision):
+        outputs = model.inference(inputs)
+    return [output.float() for output in outputs]
@@ -39,19 +39,81 @@ class ConvNorm(torch.nn.Module):
         return conv_signal
 
 
+def mel_bands(mel_basis):
+    """ start and stop bins of the nonzero band of every mel filter, 0 and 0
+    for a filter without nonzero bins """
+    nonzero = mel_basis != 0
+    start = nonzero.int().argmax(1)
+    stop = mel_basis.size(1) - nonzero.flip(1).int().argmax(1)
+    empty = ~nonzero.any(1)
+    start[empty] = 0
+    stop[empty] = 0
+    return start, stop
+
+
+# BLAS takes another code path for a handful of frames, which rounds
+# differently, so short inputs are zero-padded to this many frames to get
+# the same values per frame as long ones
+_MIN_PROJECTION_FRAMES = 32
+
+
+def _pad_frames(x):
+    if x.size(-1) >= _MIN_PROJECTION_FRAMES:
+        return x
+    return torch.nn.functional.pad(
+        x, (0, _MIN_PROJECTION_FRAMES - x.size(-1)))
+
+
 class TacotronSTFT(torch.nn.Module):
     def __init__(self, filter_length=1024, hop_length=256, win_length=1024,
                  n_mel_channels=80, sampling_rate=22050, mel_fmin=0.0,
-                 mel_fmax=8000.0):
+                 mel_fmax=8000.0, stft_backend='fft', mel_band_block=16):
+        """ mel_band_block: consecutive mel filters projected together over
+        the bins they span, 0 projects with the dense mel_basis. The two
+        differ by float rounding, keep it fixed for a dataset """
         super(TacotronSTFT, self).__init__()
         self.n_mel_channels = n_mel_channels
         self.sampling_rate = sampling_rate
-        self.stft_fn = STFT(filter_length, hop_length, win_length)
+        self.stft_fn = STFT(filter_length, hop_length, win_length,
+                            backend=stft_backend)
         mel_basis = librosa_mel_fn(
-            sampling_rate, filter_length, n_mel_channels, mel_fmin, mel_fmax)
+            sr=sampling_rate, n_fft=filter_length, n_mels=n_mel_channels,
+            fmin=mel_fmin, fmax=mel_fmax)
         mel_basis = torch.from_numpy(mel_basis).float()
         self.register_buffer('mel_basis', mel_basis)
 
+        # each triangular filter has a few nonzero bins, and the bins above
+        # mel_fmax none at all, so the projection only touches the band of
+        # every block of filters: (first filter, end filter, start bin,
+        # stop bin)
+        start, stop = mel_bands(mel_basis)
+        self.register_buffer('mel_band_start', start, persistent=False)
+        self.register_buffer('mel_band_stop', stop, persistent=False)
+        self.mel_blocks = []
+        self.mel_transpose_blocks = []
+        if mel_band_block > 0:
+            for f in range(0, n_mel_channels, mel_band_block):
+                end = min(f + mel_band_block, n_mel_channels)
+                bands = [(int(start[i]), int(stop[i])) for i in range(f, end)
+                         if stop[i] > start[i]]
+                if not bands:
+                    bands = [(0, 0)]
+                self.mel_blocks.append((f, end, min(b[0] for b in bands),
+                                        max(b[1] for b in bands)))
+
+            # the transpose splits the bins into disjoint segments instead,
+            # each with the filters that reach into it, so every output bin
+            # is written once
+            edges = sorted(set([0, mel_basis.size(1)] + [
+                block[2] for block in self.mel_blocks] + [int(stop.max())]))
+            for lo, hi in zip(edges[:-1], edges[1:]):
+                filters = ((start < hi) & (stop > lo)).nonzero().squeeze(1)
+                if len(filters) == 0:
+                    self.mel_transpose_blocks.append((0, 0, lo, hi))
+                else:
+                    self.mel_transpose_blocks.append(
+                        (int(filters.min()), int(filters.max()) + 1, lo, hi))
+
     def spectral_normalize(self, magnitudes):
         output = dynamic_range_compression(magnitudes)
         return output
@@ -60,11 +122,50 @@ class TacotronSTFT(torch.nn.Module):
         output = dynamic_range_decompression(magnitudes)
         return output
 
-    def mel_spectrogram(self, y):
+    def _use_mel_blocks(self, x):
+        # writing into slices of the output does not support autograd. The
+        # choice must not depend on the input size, a wave has to give the
+        # same mel whether it is streamed, batched or computed on its own
+        return (bool(self.mel_blocks) and
+                not (x.requires_grad and torch.is_grad_enabled()))
+
+    def mel_project(self, magnitudes):
+        """ mel_basis @ magnitudes for (..., n_freq, T) magnitudes """
+        n_frames = magnitudes.size(-1)
+        magnitudes = _pad_frames(magnitudes)
+        if not self._use_mel_blocks(magnitudes):
+            output = torch.matmul(self.mel_basis, magnitudes)
+            return output[..., :n_frames]
+        output = magnitudes.new_empty(
+            magnitudes.shape[:-2] + (self.n_mel_channels, magnitudes.size(-1)))
+        for f, end, start, stop in self.mel_blocks:
+            torch.matmul(self.mel_basis[f:end, start:stop],
+                         magnitudes[..., start:stop, :], out=output[..., f:end, :])
+        return output[..., :n_frames]
+
+    def mel_transpose(self, mel):
+        """ mel_basis.t() @ mel for (..., n_mel_channels, T) mels """
+        n_frames = mel.size(-1)
+        mel = _pad_frames(mel)
+        if not self._use_mel_blocks(mel):
+            output = torch.matmul(self.mel_basis.t(), mel)
+            return output[..., :n_frames]
+        output = mel.new_empty(
+            mel.shape[:-2] + (self.mel_basis.size(1), mel.size(-1)))
+        for f, end, start, stop in self.mel_transpose_blocks:
+            if f == end:
+                output[..., start:stop, :] = 0
+            else:
+                torch.matmul(self.mel_basis[f:end, start:stop].t(),
+                             mel[..., f:end, :], out=output[..., start:stop, :])
+        return output[..., :n_frames]
+
+    def mel_spectrogram(self, y, center=True):
         """Computes mel-spectrograms from a batch of waves
         PARAMS
         ------
         y: Variable(torch.FloatTensor) with shape (B, T) in range [-1, 1]
+        center: reflect-pad y, see STFT.transform
 
         RETURNS
         -------
@@ -73,8 +174,58 @@ class TacotronSTFT(torch.nn.Module):
         assert(torch.min(y.data) >= -1)
         assert(torch.max(y.data) <= 1)
 
-        magnitudes, phases = self.stft_fn.transform(y)
+        magnitudes, phases = self.stft_fn.transform(y, center)
         magnitudes = magnitudes.data
-        mel_output = torch.matmul(self.mel_basis, magnitudes)
+        mel_output = self.mel_project(magnitudes)
         mel_output = self.spectral_normalize(mel_output)
         return mel_output
+
+    def mel_spectrogram_stream(self, blocks):
+        """Mel-spectrogram of a wave given as consecutive blocks, yielded as
+        soon as the frames of each block are complete. The concatenated
+        output equals mel_spectrogram of the whole wave while no more than a
+        block and one frame of audio are held at a time.
+        PARAMS
+        ------
+        blocks: iterable of torch.FloatTensor with shape (B, n) in range
+            [-1, 1], of any length n
+
+        RETURNS
+        -------
+        generator of torch.FloatTensor of shape (B, n_mel_channels, frames)
+        """
+        filter_length = self.stft_fn.filter_length
+        hop_length = self.stft_fn.hop_length
+        pad = filter_length // 2
+        # samples from the start of the next frame on, in padded coordinates
+        buffer = None
+        # the last pad + 1 samples of the wave, reflected at the end
+        tail = None
+        started = False
+
+        for block in blocks:
+            buffer = block if buffer is None else torch.cat((buffer, block), 1)
+            tail = block if tail is None else torch.cat((tail, block), 1)
+            tail = tail[:, -(pad + 1):]
+            if not started:
+                if buffer.size(1) <= pad:
+                    continue
+                buffer = torch.cat((buffer[:, 1:pad + 1].flip(1), buffer), 1)
+                started = True
+            n_frames = (buffer.size(1) - filter_length) // hop_length + 1
+            if n_frames > 0:
+                yield self.mel_spectrogram(
+                    buffer[:, :(n_frames - 1) * hop_length + filter_length],
+                    center=False)
+                buffer = buffer[:, n_frames * hop_length:]
+
+        if buffer is None:
+            return
+        if not started:
+            # too short to stream, fails the same way a one-shot call does
+            yield self.mel_spectrogram(buffer)
+            return
+        buffer = torch.cat((buffer, tail[:, :-1].flip(1)), 1)
+        n_frames = (buffer.size(1) - filter_length) // hop_length + 1
+        if n_frames > 0:
+            yield self.mel_spectrogram(buffer, center=False)
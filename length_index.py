@@ -0,0 +1,138 @@
+""" Sidecar index of utterance lengths for a filelist
+
+Holds the symbol count of the cleaned text, the mel frame count and the size
+of the audio or mel file of every line, in filelist order, so samplers,
+filters and corpus reports do not have to open the data files. The index is
+built once in parallel and saved next to the filelist as
+<filelist>.lengths.npz together with a key of everything it depends on; a
+changed filelist, cleaner list, symbol set, Dataset_dir or hop length
+rebuilds it, as does a change of resample_wavs or sampling_rate. Under
+distributed training rank 0 builds it and the other ranks wait for it.
+
+python length_index.py -f filelists/train.txt --config config_sho.json
+"""
+import argparse
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+
+import numpy as np
+from scipy.io.wavfile import read
+
+from text import text_to_sequence
+from text.symbols import symbols
+from utils import load_filepaths_and_text, main_process_first, save_npz_atomic
+
+LENGTH_DTYPE = np.dtype([('text_length', np.int32), ('mel_frames', np.int32),
+                         ('file_bytes', np.int64)])
+
+_worker_args = None
+
+
+def mel_length(path, load_mel_from_disk, hop_length, sampling_rate=None):
+    """ Mel frames of a .npy mel or of the mel TacotronSTFT computes from a
+    wav, read from the file header without loading the data. sampling_rate
+    is the rate wavs are resampled to, if they are """
+    if load_mel_from_disk:
+        return np.load(path, mmap_mode='r').shape[1]
+    orig_sr, audio = read(path, mmap=True)
+    n_samples = len(audio)
+    if sampling_rate is not None and orig_sr != sampling_rate:
+        # resample_poly output length
+        n_samples = math.ceil(n_samples * sampling_rate / orig_sr)
+    return n_samples // hop_length + 1
+
+
+def resample_rate(hparams):
+    return hparams.sampling_rate if hparams.resample_wavs else None
+
+
+def index_key(filelist, hparams):
+    sha = hashlib.sha1()
+    with open(filelist, 'rb') as f:
+        sha.update(f.read())
+    sha.update(json.dumps([list(hparams.text_cleaners), hparams.Dataset_dir,
+                           bool(hparams.load_mel_from_disk),
+                           hparams.hop_length, resample_rate(hparams)]).encode())
+    sha.update('\n'.join(symbols).encode())
+    return sha.hexdigest()
+
+
+def _init_worker(args):
+    global _worker_args
+    _worker_args = args
+
+
+def _item_lengths(audiopath_and_text):
+    cleaners, dataset_dir, load_mel_from_disk, hop_length, sampling_rate = \
+        _worker_args
+    audiopath, text = audiopath_and_text[0], audiopath_and_text[1]
+    path = dataset_dir + audiopath
+    return (len(text_to_sequence(text, cleaners)),
+            mel_length(path, load_mel_from_disk, hop_length, sampling_rate),
+            os.path.getsize(path))
+
+
+def build_lengths(audiopaths_and_text, hparams, n_workers=None):
+    args = (list(hparams.text_cleaners), hparams.Dataset_dir,
+            hparams.load_mel_from_disk, hparams.hop_length,
+            resample_rate(hparams))
+    with multiprocessing.Pool(n_workers, _init_worker, (args,)) as pool:
+        rows = pool.map(_item_lengths, audiopaths_and_text, chunksize=64)
+    return np.array(rows, dtype=LENGTH_DTYPE)
+
+
+class LengthIndex(object):
+    """ lengths is a structured array with text_length, mel_frames and
+    file_bytes fields, one row per filelist line """
+    def __init__(self, filelist, hparams, n_workers=None):
+        with main_process_first():
+            self.load_or_build(filelist, hparams, n_workers)
+
+    def load_or_build(self, filelist, hparams, n_workers):
+        path = filelist + '.lengths.npz'
+        key = index_key(filelist, hparams)
+
+        if os.path.exists(path):
+            with np.load(path) as index:
+                if str(index['key']) == key:
+                    self.lengths = index['lengths']
+                    return
+
+        self.lengths = build_lengths(
+            load_filepaths_and_text(filelist), hparams, n_workers)
+        save_npz_atomic(path, key=key, lengths=self.lengths)
+
+    def __len__(self):
+        return len(self.lengths)
+
+
+def report(lengths, hparams):
+    mel_frames = lengths['mel_frames']
+    max_frames = hparams.max_decoder_steps * hparams.n_frames_per_step
+    hours = mel_frames.sum() * hparams.hop_length / hparams.sampling_rate / 3600
+    print("{} utterances, {:.2f} hours, {:.2f} GB".format(
+        len(lengths), hours, lengths['file_bytes'].sum() / 1e9))
+    for field in ('text_length', 'mel_frames'):
+        percentiles = np.percentile(lengths[field], [0, 50, 90, 99, 100])
+        print("{:12s} min {:.0f} median {:.0f} p90 {:.0f} p99 {:.0f} "
+              "max {:.0f}".format(field, *percentiles))
+    print("{} utterances above max_decoder_steps ({} frames)".format(
+        int((mel_frames > max_frames).sum()), max_frames))
+
+
+if __name__ == '__main__':
+    from hparams import create_hparams_from_json
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filelist', type=str, required=True)
+    parser.add_argument('--config', type=str, default='config_sho.json')
+    parser.add_argument('--hparams', type=str, required=False,
+                        help='comma separated name=value pairs')
+    parser.add_argument('--n_workers', type=int, default=None)
+    args = parser.parse_args()
+
+    hparams = create_hparams_from_json(args.config, args.hparams)
+    report(LengthIndex(args.filelist, hparams, args.n_workers).lengths, hparams)
@@ -0,0 +1,120 @@
+""" Per-channel mel mean and std of a filelist for normalize_mel
+
+Streams over the filelist once: every worker process folds the mels of its
+items into running (count, mean, M2) statistics and the parent merges the
+partial statistics with Chan's parallel update, so no more than one mel per
+worker is in memory. Mels are read from disk when load_mel_from_disk is set
+and computed from the wavs with TacotronSTFT otherwise. The output has
+shape (2, n_mel_channels, 1) and is what the mel_mean_std hparam expects,
+TextMelLoader normalizes with (mel - mean_std[0]) / mean_std[1].
+
+python mel_stats.py -f filelists/train.txt -o mean_std.npy --config config_sho.json
+"""
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+import torch
+
+from hparams import create_hparams_from_json
+from layers import TacotronSTFT
+from utils import load_wav_to_torch, load_filepaths_and_text
+
+_stft = None
+_args = None
+
+
+def merge_stats(a, b):
+    """ Chan et al. parallel update of (count, mean, M2) statistics """
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    if n_a == 0:
+        return b
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (n_b / n)
+    m2 = m2_a + m2_b + delta ** 2 * (n_a * n_b / n)
+    return n, mean, m2
+
+
+def mel_stats(mel):
+    mel = mel.astype(np.float64)
+    mean = mel.mean(axis=1)
+    return mel.shape[1], mean, ((mel - mean[:, None]) ** 2).sum(axis=1)
+
+
+def _init_worker(stft_args, args):
+    global _stft, _args
+    torch.set_num_threads(1)
+    _stft = TacotronSTFT(*stft_args)
+    _args = args
+
+
+def load_mel(audiopath):
+    dataset_dir, load_mel_from_disk, max_wav_value, resample_wavs = _args
+    if load_mel_from_disk:
+        return np.load(dataset_dir + audiopath)
+    audio, sampling_rate = load_wav_to_torch(
+        dataset_dir + audiopath,
+        _stft.sampling_rate if resample_wavs else None)
+    if sampling_rate != _stft.sampling_rate:
+        raise ValueError("{} {} SR doesn't match target {} SR".format(
+            audiopath, sampling_rate, _stft.sampling_rate))
+    with torch.no_grad():
+        mel = _stft.mel_spectrogram((audio / max_wav_value).unsqueeze(0))
+    return mel.squeeze(0).numpy()
+
+
+def _chunk_stats(audiopaths):
+    stats = (0, 0.0, 0.0)
+    for audiopath in audiopaths:
+        stats = merge_stats(stats, mel_stats(load_mel(audiopath)))
+    return stats
+
+
+def compute_mean_std(filelist, hparams, n_workers=None, chunk_size=32):
+    audiopaths = [x[0] for x in load_filepaths_and_text(filelist)]
+    chunks = [audiopaths[i:i + chunk_size]
+              for i in range(0, len(audiopaths), chunk_size)]
+    stft_args = (hparams.filter_length, hparams.hop_length, hparams.win_length,
+                 hparams.n_mel_channels, hparams.sampling_rate,
+                 hparams.mel_fmin, hparams.mel_fmax)
+    args = (hparams.Dataset_dir, hparams.load_mel_from_disk,
+            hparams.max_wav_value, hparams.resample_wavs)
+
+    stats = (0, 0.0, 0.0)
+    n_items = 0
+    start = time.perf_counter()
+    with multiprocessing.Pool(n_workers, _init_worker,
+                              (stft_args, args)) as pool:
+        for i, chunk in enumerate(pool.imap_unordered(_chunk_stats, chunks)):
+            stats = merge_stats(stats, chunk)
+            n_items += chunk_size
+            if (i + 1) % 100 == 0:
+                print("{}/{} items, {:.1f} items/s".format(
+                    min(n_items, len(audiopaths)), len(audiopaths),
+                    n_items / (time.perf_counter() - start)))
+
+    n, mean, m2 = stats
+    std = np.sqrt(m2 / n)
+    print("{} items, {} frames".format(len(audiopaths), n))
+    return np.stack([mean, std])[:, :, None].astype(np.float32)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filelist', type=str, required=True)
+    parser.add_argument('-o', '--output_path', type=str, required=True,
+                        help='.npy file to pass as the mel_mean_std hparam')
+    parser.add_argument('--config', type=str, default='config_sho.json')
+    parser.add_argument('--hparams', type=str, required=False,
+                        help='comma separated name=value pairs')
+    parser.add_argument('--n_workers', type=int, default=None)
+    args = parser.parse_args()
+
+    hparams = create_hparams_from_json(args.config, args.hparams)
+    mean_std = compute_mean_std(args.filelist, hparams, args.n_workers)
+    np.save(args.output_path, mean_std)
+    print("Saved mean and std of shape {} to '{}'".format(
+        mean_std.shape, args.output_path))
@@ -11,6 +11,20 @@ sys.path.append("/work/Git/")
 from tacotron2.utils import to_gpu, get_mask_from_lengths
 
 
+def autocast_dtype(device_type):
+    """ dtype autocast runs at on device_type, None when autocast is off """
+    if hasattr(torch, 'get_autocast_dtype'):
+        # torch >= 2.4, the per-device functions below are deprecated there
+        if torch.is_autocast_enabled(device_type):
+            return torch.get_autocast_dtype(device_type)
+        return None
+    if device_type == 'cuda' and torch.is_autocast_enabled():
+        return torch.get_autocast_gpu_dtype()
+    if device_type == 'cpu' and torch.is_autocast_cpu_enabled():
+        return torch.get_autocast_cpu_dtype()
+    return None
+
+
 class LocationLayer(nn.Module):
     def __init__(self, attention_n_filters, attention_kernel_size,
                  attention_dim):
@@ -29,11 +43,32 @@ class LocationLayer(nn.Module):
         processed_attention = self.location_dense(processed_attention)
         return processed_attention
 
+    def forward_window(self, attention_weights_window):
+        """ Same as forward for a window of weights that already carries the
+        kernel's left and right context, so the convolution is unpadded
+        PARAMS
+        ------
+        attention_weights_window: (B, 2, W + kernel_size - 1)
+
+        RETURNS
+        -------
+        processed attention (B, W, attention_dim)
+        """
+        conv = self.location_conv.conv
+        processed_attention = F.conv1d(
+            attention_weights_window, conv.weight, conv.bias)
+        processed_attention = processed_attention.transpose(1, 2)
+        processed_attention = self.location_dense(processed_attention)
+        return processed_attention
+
 
 class Attention(nn.Module):
     def __init__(self, attention_rnn_dim, embedding_dim, attention_dim,
-                 attention_location_n_filters, attention_location_kernel_size):
+                 attention_location_n_filters, attention_location_kernel_size,
+                 window_backward=0, window_forward=0):
         super(Attention, self).__init__()
+        self.window_backward = window_backward
+        self.window_forward = window_forward
         self.query_layer = LinearNorm(attention_rnn_dim, attention_dim,
                                       bias=False, w_init_gain='tanh')
         self.memory_layer = LinearNorm(embedding_dim, attention_dim, bias=False,
@@ -45,13 +80,15 @@ class Attention(nn.Module):
         self.score_mask_value = -float("inf")
 
     def get_alignment_energies(self, query, processed_memory,
-                               attention_weights_cat):
+                               attention_weights_cat, workspace=None):
         """
         PARAMS
         ------
         query: decoder output (batch, n_mel_channels * n_frames_per_step)
         processed_memory: processed encoder outputs (B, T_in, attention_dim)
         attention_weights_cat: cumulative and prev. att weights (B, 2, max_time)
+        workspace: optional (B, T_in, attention_dim) buffer the pre-activation
+            sum is accumulated into instead of allocating new tensors
 
         RETURNS
         -------
@@ -60,14 +97,19 @@ class Attention(nn.Module):
 
         processed_query = self.query_layer(query.unsqueeze(1))
         processed_attention_weights = self.location_layer(attention_weights_cat)
-        energies = self.v(torch.tanh(
-            processed_query + processed_attention_weights + processed_memory))
+        if workspace is None:
+            energies = self.v(torch.tanh(
+                processed_query + processed_attention_weights + processed_memory))
+        else:
+            torch.add(processed_memory, processed_query, out=workspace)
+            workspace.add_(processed_attention_weights).tanh_()
+            energies = self.v(workspace)
 
         energies = energies.squeeze(-1)
         return energies
 
     def forward(self, attention_hidden_state, memory, processed_memory,
-                attention_weights_cat, mask):
+                attention_weights_cat, mask, workspace=None):
         """
         PARAMS
         ------
@@ -76,9 +118,11 @@ class Attention(nn.Module):
         processed_memory: processed encoder outputs
         attention_weights_cat: previous and cummulative attention weights
         mask: binary mask for padded data
+        workspace: optional energies buffer, see get_alignment_energies
         """
         alignment = self.get_alignment_energies(
-            attention_hidden_state, processed_memory, attention_weights_cat)
+            attention_hidden_state, processed_memory, attention_weights_cat,
+            workspace)
 
         if mask is not None:
             alignment.data.masked_fill_(mask, self.score_mask_value)
@@ -89,6 +133,71 @@ class Attention(nn.Module):
 
         return attention_context, attention_weights
 
+    def forward_windowed(self, attention_hidden_state, memory, processed_memory,
+                         attention_weights_cat, mask):
+        """ Attention restricted to window_backward positions before and
+        window_forward positions after the previous attention peak, so the
+        cost of a step does not grow with the input length. Equivalent to
+        forward with every position outside the window masked out
+        PARAMS
+        ------
+        same as forward
+
+        RETURNS
+        -------
+        attention_context: (B, embedding_dim)
+        attention_weights: full length weights (B, max_time), zero outside
+            the window
+        """
+        B, MAX_TIME = attention_weights_cat.size(0), attention_weights_cat.size(2)
+        window = self.window_backward + self.window_forward + 1
+        if window >= MAX_TIME:
+            return self.forward(attention_hidden_state, memory,
+                                processed_memory, attention_weights_cat, mask)
+
+        # shift windows that would cross the edges back inside [0, max_time)
+        peak = attention_weights_cat[:, 0].argmax(dim=1)
+        start = (peak - self.window_backward).clamp(0, MAX_TIME - window)
+        offsets = torch.arange(window, device=memory.device)
+        indices = start.unsqueeze(1) + offsets
+
+        # previous and cumulative weights with the location kernel's context,
+        # zero outside the sequence as with the padded convolution
+        padding = self.location_layer.location_conv.conv.padding[0]
+        context_offsets = torch.arange(
+            -padding, window + padding, device=memory.device)
+        context_indices = start.unsqueeze(1) + context_offsets
+        in_range = (context_indices >= 0) & (context_indices < MAX_TIME)
+        weights_window = attention_weights_cat.gather(
+            2, context_indices.clamp(0, MAX_TIME - 1).unsqueeze(1).expand(
+                B, 2, -1))
+        weights_window = weights_window * in_range.unsqueeze(1).to(
+            weights_window.dtype)
+
+        processed_memory_window = processed_memory.gather(
+            1, indices.unsqueeze(2).expand(-1, -1, processed_memory.size(2)))
+        memory_window = memory.gather(
+            1, indices.unsqueeze(2).expand(-1, -1, memory.size(2)))
+
+        processed_query = self.query_layer(attention_hidden_state.unsqueeze(1))
+        processed_attention_weights = self.location_layer.forward_window(
+            weights_window)
+        alignment = self.v(torch.tanh(
+            processed_query + processed_attention_weights +
+            processed_memory_window)).squeeze(-1)
+
+        if mask is not None:
+            alignment.data.masked_fill_(
+                mask.gather(1, indices), self.score_mask_value)
+
+        window_weights = F.softmax(alignment, dim=1)
+        attention_context = torch.bmm(
+            window_weights.unsqueeze(1), memory_window).squeeze(1)
+        attention_weights = window_weights.new_zeros(B, MAX_TIME).scatter(
+            1, indices, window_weights)
+
+        return attention_context, attention_weights
+
 
 class Prenet(nn.Module):
     def __init__(self, in_dim, sizes):
@@ -142,14 +251,85 @@ class Postnet(nn.Module):
                 nn.BatchNorm1d(hparams.n_mel_channels))
             )
 
-    def forward(self, x):
+    def forward(self, x, output_lengths=None):
+        """
+        PARAMS
+        ------
+        x: decoder mel outputs (B, n_mel_channels, T_out)
+        output_lengths: per-row number of valid frames. When given, padded
+            frames are zeroed before every convolution so each row matches
+            the output it would get if it was run on its own
+        """
+        if output_lengths is not None:
+            mask = get_mask_from_lengths(output_lengths).unsqueeze(1).to(x.dtype)
         for i in range(len(self.convolutions) - 1):
+            if output_lengths is not None:
+                x = x * mask
             x = F.dropout(torch.tanh(self.convolutions[i](x)), 0.5, self.training)
+        if output_lengths is not None:
+            x = x * mask
         x = F.dropout(self.convolutions[-1](x), 0.5, self.training)
 
         return x
 
 
+class PostnetStream():
+    """ Runs a Postnet incrementally over mel frames as they are decoded.
+    Each call to push returns the residual-refined frames whose receptive
+    field is complete, so the concatenated chunks equal
+    mel + postnet(mel) computed over the whole utterance.
+    """
+    def __init__(self, postnet):
+        self.postnet = postnet
+        # frames each side a postnet output depends on, 2 per kernel 5 conv
+        self.context = sum(conv[0].conv.padding[0] * conv[0].conv.dilation[0]
+                           for conv in postnet.convolutions)
+        self.frames = None  # decoder frames from buffer_start onwards
+        self.buffer_start = 0
+        self.n_emitted = 0
+
+    def _refine(self, end):
+        # outputs in [n_emitted, end) are exact as long as the window carries
+        # `context` frames on each side or reaches the utterance boundary
+        start = self.n_emitted
+        window_start = max(0, start - self.context)
+        window = self.frames[:, :, window_start - self.buffer_start:]
+        refined = self.postnet(window)[:, :, start - window_start:
+                                       end - window_start]
+        mel = self.frames[:, :, start - self.buffer_start:
+                          end - self.buffer_start]
+        self.n_emitted = end
+
+        # drop frames that no later window can reach
+        keep_from = max(0, end - self.context)
+        self.frames = self.frames[:, :, keep_from - self.buffer_start:]
+        self.buffer_start = keep_from
+        return mel + refined
+
+    def push(self, mel_frames):
+        """
+        PARAMS
+        ------
+        mel_frames: new decoder frames (B, n_mel_channels, n)
+
+        RETURNS
+        -------
+        refined frames (B, n_mel_channels, m), m may be 0
+        """
+        if self.frames is None:
+            self.frames = mel_frames
+        else:
+            self.frames = torch.cat((self.frames, mel_frames), dim=2)
+        end = self.buffer_start + self.frames.size(2) - self.context
+        if end <= self.n_emitted:
+            return mel_frames[:, :, :0]
+        return self._refine(end)
+
+    def flush(self):
+        """ Refines the remaining frames once the decoder has stopped """
+        return self._refine(self.buffer_start + self.frames.size(2))
+
+
 class Encoder(nn.Module):
     """Encoder module:
         - Three 1-d convolution banks
@@ -193,15 +373,36 @@ class Encoder(nn.Module):
 
         return outputs
 
-    def inference(self, x):
+    def inference(self, x, input_lengths=None):
+        """
+        PARAMS
+        ------
+        x: embedded inputs (B, encoder_embedding_dim, T_in)
+        input_lengths: text lengths of a padded batch, None for a single
+            utterance. Padded positions are zeroed before every convolution
+            and packed out of the BiLSTM so they cannot leak into real ones
+        """
+        if input_lengths is not None:
+            mask = get_mask_from_lengths(input_lengths).unsqueeze(1).to(x.dtype)
         for conv in self.convolutions:
+            if input_lengths is not None:
+                x = x * mask
             x = F.dropout(F.relu(conv(x)), 0.5, self.training)
 
         x = x.transpose(1, 2)
 
+        if input_lengths is not None:
+            x = nn.utils.rnn.pack_padded_sequence(
+                x, input_lengths.cpu().numpy(), batch_first=True,
+                enforce_sorted=False)
+
         self.lstm.flatten_parameters()
         outputs, _ = self.lstm(x)
 
+        if input_lengths is not None:
+            outputs, _ = nn.utils.rnn.pad_packed_sequence(
+                outputs, batch_first=True)
+
         return outputs
 
 
@@ -211,7 +412,7 @@ class Decoder(nn.Module):
         self.n_mel_channels = hparams.n_mel_channels
         self.n_frames_per_step = hparams.n_frames_per_step
         if hparams.include_ed and hparams.combination=="concatenation":
-            self.encoder_embedding_dim = hparams.encoder_embedding_dim + np.array(hparams["phones_words_utterance"]).sum()*4
+            self.encoder_embedding_dim = hparams.encoder_embedding_dim + int(np.array(hparams["phones_words_utterance"]).sum())*4
         else:
             self.encoder_embedding_dim = hparams.encoder_embedding_dim
         self.attention_rnn_dim = hparams.attention_rnn_dim
@@ -221,6 +422,9 @@ class Decoder(nn.Module):
         self.gate_threshold = hparams.gate_threshold
         self.p_attention_dropout = hparams.p_attention_dropout
         self.p_decoder_dropout = hparams.p_decoder_dropout
+        self.decoder_workspace = hparams.decoder_workspace
+        self.attention_window_training = hparams.attention_window_training
+        self.attention_window_inference = hparams.attention_window_inference
 
         self.prenet = Prenet(
             hparams.n_mel_channels * hparams.n_frames_per_step,
@@ -233,7 +437,8 @@ class Decoder(nn.Module):
         self.attention_layer = Attention(
             hparams.attention_rnn_dim, self.encoder_embedding_dim,
             hparams.attention_dim, hparams.attention_location_n_filters,
-            hparams.attention_location_kernel_size)
+            hparams.attention_location_kernel_size,
+            hparams.attention_window_backward, hparams.attention_window_forward)
 
         self.decoder_rnn = nn.LSTMCell(
             hparams.attention_rnn_dim + self.encoder_embedding_dim,
@@ -269,7 +474,7 @@ class Decoder(nn.Module):
         PARAMS
         ------
         memory: Encoder outputs
-        mask: Mask for padded data if training, expects None for inference
+        mask: Mask for padded data, None for single utterance inference
         """
         B = memory.size(0)
         MAX_TIME = memory.size(1)
@@ -295,6 +500,58 @@ class Decoder(nn.Module):
         self.processed_memory = self.attention_layer.memory_layer(memory)
         self.mask = mask
 
+    def initialize_decoder_workspace(self, max_steps):
+        """ Preallocates the buffers used by decode_inplace. Must be called
+        after initialize_decoder_states; the attention weights and context
+        become views into the workspace so no step concatenates tensors
+        PARAMS
+        ------
+        max_steps: number of decoder steps the output buffers can hold
+        """
+        B, MAX_TIME = self.attention_weights.size()
+        n_mel = self.n_mel_channels * self.n_frames_per_step
+        new_zeros = self.memory.new_zeros
+
+        # [prenet output | attention context]
+        self.cell_input = new_zeros(B, self.prenet_dim + self.encoder_embedding_dim)
+        # [previous weights, cumulative weights]
+        self.attention_weights_cat = new_zeros(B, 2, MAX_TIME)
+        self.attention_weights = self.attention_weights_cat[:, 0]
+        self.attention_weights_cum = self.attention_weights_cat[:, 1]
+        # [attention hidden | attention context]
+        self.decoder_rnn_input = new_zeros(
+            B, self.attention_rnn_dim + self.encoder_embedding_dim)
+        # the out= projection is not autocast, run it in the autocast dtype
+        projection_dtype = autocast_dtype(self.memory.device.type)
+        if projection_dtype is None:
+            projection_dtype = self.memory.dtype
+        # [decoder hidden | attention context]
+        self.projection_input = new_zeros(
+            B, self.decoder_rnn_dim + self.encoder_embedding_dim,
+            dtype=projection_dtype)
+        self.attention_context = self.projection_input[:, self.decoder_rnn_dim:]
+        self.attention_energies = torch.empty_like(self.processed_memory)
+
+        # mel and gate projections fused into one matmul, unless the layers
+        # were swapped for quantized ones
+        self.fused_projection = isinstance(
+            self.linear_projection.linear_layer, nn.Linear) and isinstance(
+                self.gate_layer.linear_layer, nn.Linear)
+        if self.fused_projection:
+            self.projection_weight = torch.cat(
+                (self.linear_projection.linear_layer.weight,
+                 self.gate_layer.linear_layer.weight),
+                dim=0).t().contiguous().to(projection_dtype)
+            self.projection_bias = torch.cat(
+                (self.linear_projection.linear_layer.bias,
+                 self.gate_layer.linear_layer.bias),
+                dim=0).to(projection_dtype)
+
+        # (T_max, B, n_mel_channels + 1), last column holds the gate energies
+        self.projection_outputs = self.memory.new_empty(
+            max_steps, B, n_mel + 1, dtype=projection_dtype)
+        self.alignment_outputs = self.memory.new_empty(max_steps, B, MAX_TIME)
+
     def parse_decoder_inputs(self, decoder_inputs):
         """ Prepares decoder inputs, i.e. mel outputs
         PARAMS
@@ -344,6 +601,22 @@ class Decoder(nn.Module):
 
         return mel_outputs, gate_outputs, alignments
 
+    def attend(self, attention_weights_cat, workspace=None):
+        """ Runs the attention layer on the stored states, windowed if
+        enabled for the current mode
+        """
+        if self.training:
+            windowed = self.attention_window_training
+        else:
+            windowed = self.attention_window_inference
+        if windowed:
+            return self.attention_layer.forward_windowed(
+                self.attention_hidden, self.memory, self.processed_memory,
+                attention_weights_cat, self.mask)
+        return self.attention_layer(
+            self.attention_hidden, self.memory, self.processed_memory,
+            attention_weights_cat, self.mask, workspace)
+
     def decode(self, decoder_input):
         """ Decoder step using stored states, attention and memory
         PARAMS
@@ -365,9 +638,8 @@ class Decoder(nn.Module):
         attention_weights_cat = torch.cat(
             (self.attention_weights.unsqueeze(1),
              self.attention_weights_cum.unsqueeze(1)), dim=1)
-        self.attention_context, self.attention_weights = self.attention_layer(
-            self.attention_hidden, self.memory, self.processed_memory,
-            attention_weights_cat, self.mask)
+        self.attention_context, self.attention_weights = self.attend(
+            attention_weights_cat)
 
         self.attention_weights_cum += self.attention_weights
         decoder_input = torch.cat(
@@ -385,6 +657,85 @@ class Decoder(nn.Module):
         gate_prediction = self.gate_layer(decoder_hidden_attention_context)
         return decoder_output, gate_prediction, self.attention_weights
 
+    def parse_workspace_outputs(self, n_steps):
+        """ Same as parse_decoder_outputs for the first n_steps of the
+        workspace output buffers
+        """
+        n_mel = self.n_mel_channels * self.n_frames_per_step
+        projection_outputs = self.projection_outputs[:n_steps]
+        # the outputs are copied out of the buffers: views would be
+        # overwritten by the next call and keep the whole workspace alive
+        # (T_out, B, T_in) -> (B, T_out, T_in)
+        alignments = self.alignment_outputs[:n_steps].transpose(0, 1)
+        alignments = alignments.clone(memory_format=torch.contiguous_format)
+        # (T_out, B) -> (B, T_out)
+        gate_outputs = projection_outputs[:, :, n_mel].transpose(0, 1)
+        gate_outputs = gate_outputs.clone(memory_format=torch.contiguous_format)
+        # (T_out, B, n_mel_channels) -> (B, T_out, n_mel_channels)
+        mel_outputs = projection_outputs[:, :, :n_mel].transpose(0, 1)
+        mel_outputs = mel_outputs.clone(memory_format=torch.contiguous_format)
+        # decouple frames per step
+        mel_outputs = mel_outputs.view(
+            mel_outputs.size(0), -1, self.n_mel_channels)
+        # (B, T_out, n_mel_channels) -> (B, n_mel_channels, T_out)
+        mel_outputs = mel_outputs.transpose(1, 2)
+
+        return mel_outputs, gate_outputs, alignments
+
+    def decode_inplace(self, decoder_input, step):
+        """ Decoder step writing into the buffers of
+        initialize_decoder_workspace instead of concatenating new tensors.
+        Only meant for inference, the buffers are overwritten every step
+        PARAMS
+        ------
+        decoder_input: prenet output of the previous mel output
+        step: index of the output row to write
+
+        RETURNS
+        -------
+        mel_output: view into the mel output buffer
+        gate_output: view into the gate output buffer
+        attention_weights: view into the alignment buffer
+        """
+        n_mel = self.n_mel_channels * self.n_frames_per_step
+
+        self.cell_input[:, :self.prenet_dim].copy_(decoder_input)
+        self.attention_hidden, self.attention_cell = self.attention_rnn(
+            self.cell_input, (self.attention_hidden, self.attention_cell))
+        self.attention_hidden = F.dropout(
+            self.attention_hidden, self.p_attention_dropout, self.training)
+
+        attention_context, attention_weights = self.attend(
+            self.attention_weights_cat, self.attention_energies)
+        self.attention_weights.copy_(attention_weights)
+        self.attention_weights_cum.add_(attention_weights)
+        self.alignment_outputs[step].copy_(attention_weights)
+
+        self.cell_input[:, self.prenet_dim:].copy_(attention_context)
+        self.decoder_rnn_input[:, self.attention_rnn_dim:].copy_(attention_context)
+        self.attention_context.copy_(attention_context)
+        self.decoder_rnn_input[:, :self.attention_rnn_dim].copy_(
+            self.attention_hidden)
+        self.decoder_hidden, self.decoder_cell = self.decoder_rnn(
+            self.decoder_rnn_input, (self.decoder_hidden, self.decoder_cell))
+        self.decoder_hidden = F.dropout(
+            self.decoder_hidden, self.p_decoder_dropout, self.training)
+
+        self.projection_input[:, :self.decoder_rnn_dim].copy_(
+            self.decoder_hidden)
+        projection_output = self.projection_outputs[step]
+        if self.fused_projection:
+            torch.addmm(self.projection_bias, self.projection_input,
+                        self.projection_weight, out=projection_output)
+        else:
+            projection_output[:, :n_mel].copy_(
+                self.linear_projection(self.projection_input))
+            projection_output[:, n_mel:].copy_(
+                self.gate_layer(self.projection_input))
+
+        return (projection_output[:, :n_mel], projection_output[:, n_mel:],
+                self.alignment_outputs[step])
+
     def forward(self, memory, decoder_inputs, memory_lengths):
         """ Decoder forward pass for training
         PARAMS
@@ -422,43 +773,97 @@ class Decoder(nn.Module):
 
         return mel_outputs, gate_outputs, alignments
 
-    def inference(self, memory):
-        """ Decoder inference
+    def inference_steps(self, memory, memory_lengths=None):
+        """ Generator running the decoder inference loop one step at a time.
+        Stops once every row's gate has fired or max_decoder_steps is reached;
+        self.mel_lengths holds the number of frames decoded for each row so far
         PARAMS
         ------
         memory: Encoder outputs
+        memory_lengths: Encoder output lengths for attention masking, None for
+            a single utterance
 
-        RETURNS
+        YIELDS
         -------
-        mel_outputs: mel outputs from the decoder
-        gate_outputs: gate outputs from the decoder
-        alignments: sequence of attention weights from the decoder
+        mel_output: mel output of the step (B, n_mel_channels * n_frames_per_step)
+        gate_output: gate output energies of the step (B, 1)
+        attention_weights: attention weights of the step (B, max_time)
         """
         decoder_input = self.get_go_frame(memory)
 
-        self.initialize_decoder_states(memory, mask=None)
+        if memory_lengths is None:
+            mask = None
+        else:
+            mask = ~get_mask_from_lengths(memory_lengths)
+        self.initialize_decoder_states(memory, mask=mask)
+        # in-place ops on the workspace cannot be recorded by autograd
+        self.use_workspace = \
+            self.decoder_workspace and not torch.is_grad_enabled()
+        if self.use_workspace:
+            self.initialize_decoder_workspace(self.max_decoder_steps)
+
+        # every row stops on its own gate, the loop runs until all have
+        B = memory.size(0)
+        self.mel_lengths = memory.new_zeros(B, dtype=torch.long)
+        not_finished = memory.new_ones(B, dtype=torch.bool)
 
-        mel_outputs, gate_outputs, alignments = [], [], []
+        n_steps = 0
         while True:
             decoder_input = self.prenet(decoder_input)
-            mel_output, gate_output, alignment = self.decode(decoder_input)
+            if self.use_workspace:
+                mel_output, gate_output, alignment = self.decode_inplace(
+                    decoder_input, n_steps)
+            else:
+                mel_output, gate_output, alignment = self.decode(decoder_input)
+            n_steps += 1
 
-            mel_outputs += [mel_output.squeeze(1)]
-            gate_outputs += [gate_output]
-            alignments += [alignment]
+            self.mel_lengths += not_finished.long()
+            not_finished &= torch.sigmoid(
+                gate_output.data.squeeze(1)) <= self.gate_threshold
+            yield mel_output, gate_output, alignment
 
-            if torch.sigmoid(gate_output.data) > self.gate_threshold:
+            if not not_finished.any():
                 break
-            elif len(mel_outputs) == self.max_decoder_steps:
+            elif n_steps == self.max_decoder_steps:
                 print("Warning! Reached max decoder steps")
                 break
 
             decoder_input = mel_output
 
-        mel_outputs, gate_outputs, alignments = self.parse_decoder_outputs(
-            mel_outputs, gate_outputs, alignments)
+    def inference(self, memory, memory_lengths=None):
+        """ Decoder inference
+        PARAMS
+        ------
+        memory: Encoder outputs
+        memory_lengths: Encoder output lengths for attention masking, None for
+            a single utterance
 
-        return mel_outputs, gate_outputs, alignments
+        RETURNS
+        -------
+        mel_outputs: mel outputs from the decoder
+        gate_outputs: gate outputs from the decoder
+        alignments: sequence of attention weights from the decoder
+        mel_lengths: number of frames decoded for each row before its gate
+            fired
+        """
+        mel_outputs, gate_outputs, alignments = [], [], []
+        n_steps = 0
+        for mel_output, gate_output, alignment in self.inference_steps(
+                memory, memory_lengths):
+            if not self.use_workspace:
+                mel_outputs += [mel_output.squeeze(1)]
+                gate_outputs += [gate_output.squeeze(1)]
+                alignments += [alignment]
+            n_steps += 1
+
+        if self.use_workspace:
+            mel_outputs, gate_outputs, alignments = \
+                self.parse_workspace_outputs(n_steps)
+        else:
+            mel_outputs, gate_outputs, alignments = self.parse_decoder_outputs(
+                mel_outputs, gate_outputs, alignments)
+
+        return mel_outputs, gate_outputs, alignments, self.mel_lengths
 
 
 class Tacotron2(nn.Module):
@@ -482,11 +887,11 @@ class Tacotron2(nn.Module):
         self.concatenation_embedding = hparams.concatenation_embedding
         if hparams.include_ed:
             if hparams.combination=="addition":
-                self.ed_embedding = LinearNorm(self.ed_bool_list.sum(), hparams.encoder_embedding_dim,
+                self.ed_embedding = LinearNorm(int(self.ed_bool_list.sum()), hparams.encoder_embedding_dim,
                                                bias=False, w_init_gain='tanh')
             elif hparams.combination=="concatenation":
                 if hparams.concatenation_embedding:
-                    self.ed_embedding = LinearNorm(self.ed_bool_list.sum(), self.ed_bool_list.sum())
+                    self.ed_embedding = LinearNorm(int(self.ed_bool_list.sum()), int(self.ed_bool_list.sum()))
             else:
                 assert False, "combination should be either 'concatenation' or 'addition'"
 
@@ -521,21 +926,12 @@ class Tacotron2(nn.Module):
     def forward(self, inputs):
         text_inputs, text_lengths, mels, max_len, output_lengths, ed, sp = inputs
         text_lengths, output_lengths = text_lengths.data, output_lengths.data
-        ed = ed[:, self.ed_bool_list, :]
+        ed = self.select_ed(ed)
 
         embedded_inputs = self.embedding(text_inputs).transpose(1, 2)
 
         encoder_outputs = self.encoder(embedded_inputs, text_lengths)
-        if self.include_ed:
-            if self.combination=="concatenation":
-                if self.concatenation_embedding:
-                    encoder_outputs = torch.cat([encoder_outputs, self.ed_embedding(ed.transpose(1, 2))], axis=2)
-                else:
-                    encoder_outputs = torch.cat([encoder_outputs, ed.transpose(1, 2)], axis=2)
-            elif self.combination=="addition":
-                encoder_outputs = encoder_outputs + self.ed_embedding(ed.transpose(1, 2))
-            else:
-                assert False, "combination should be either 'concatenation' or 'addition'"
+        encoder_outputs = self.combine_ed(encoder_outputs, ed)
 
         mel_outputs, gate_outputs, alignments = self.decoder(
             encoder_outputs, mels, memory_lengths=text_lengths)
@@ -547,29 +943,163 @@ class Tacotron2(nn.Module):
             [mel_outputs, mel_outputs_postnet, gate_outputs, alignments],
             output_lengths)
 
-    def inference(self, inputs):
-        inputs, ed = inputs
-        ed = ed[:, self.ed_bool_list, :]
-        embedded_inputs = self.embedding(inputs).transpose(1, 2)
-        encoder_outputs = self.encoder.inference(embedded_inputs)
+    def select_ed(self, ed):
+        """ Emotion intensity channels picked by phones_words_utterance,
+        ed is passed through when TextMelCollate already selected them """
+        if ed.size(1) == len(self.ed_bool_list):
+            ed = ed[:, self.ed_bool_list, :]
+        return ed
+
+    def combine_ed(self, encoder_outputs, ed):
+        """ Conditions encoder outputs on the selected emotion intensity
+        channels according to `combination`
+        PARAMS
+        ------
+        encoder_outputs: (B, T_in, encoder_embedding_dim)
+        ed: selected emotion intensity channels (B, n_ed, T_in)
+        """
         if self.include_ed:
             if self.combination=="concatenation":
                 if self.concatenation_embedding:
                     encoder_outputs = torch.cat([encoder_outputs, self.ed_embedding(ed.transpose(1, 2))], axis=2)
                 else:
                     encoder_outputs = torch.cat([encoder_outputs, ed.transpose(1, 2)], axis=2)
-            # encoder_outputs = torch.cat([encoder_outputs, ed.transpose(1, 2)], axis=2)
             elif self.combination=="addition":
                 encoder_outputs = encoder_outputs + self.ed_embedding(ed.transpose(1, 2))
             else:
                 assert False, "combination should be either 'concatenation' or 'addition'"
-        mel_outputs, gate_outputs, alignments = self.decoder.inference(
-            encoder_outputs)
+        return encoder_outputs
 
-        mel_outputs_postnet = self.postnet(mel_outputs)
+    def _inference(self, inputs):
+        if len(inputs) == 3:
+            inputs, ed, input_lengths = inputs
+        else:
+            (inputs, ed), input_lengths = inputs, None
+        ed = self.select_ed(ed)
+        embedded_inputs = self.embedding(inputs).transpose(1, 2)
+        encoder_outputs = self.encoder.inference(embedded_inputs, input_lengths)
+        encoder_outputs = self.combine_ed(encoder_outputs, ed)
+        return self._decode(encoder_outputs, input_lengths)
+
+    def _decode(self, encoder_outputs, input_lengths=None):
+        mel_outputs, gate_outputs, alignments, mel_lengths = \
+            self.decoder.inference(encoder_outputs, input_lengths)
+
+        mel_outputs_postnet = self.postnet(mel_outputs, mel_lengths)
         mel_outputs_postnet = mel_outputs + mel_outputs_postnet
 
         outputs = self.parse_output(
-            [mel_outputs, mel_outputs_postnet, gate_outputs, alignments])
+            [mel_outputs, mel_outputs_postnet, gate_outputs, alignments],
+            mel_lengths)
+
+        return outputs, mel_lengths
+
+    def inference(self, inputs):
+        """
+        PARAMS
+        ------
+        inputs: (text, ed) for a single utterance or
+            (text_padded, ed_padded, input_lengths) for a padded batch
 
+        RETURNS
+        -------
+        mel_outputs, mel_outputs_postnet, gate_outputs, alignments padded to
+        the longest row, with padded frames masked as in training
+        """
+        outputs, _ = self._inference(inputs)
         return outputs
+
+    def inference_stream(self, inputs, chunk_size=32):
+        """ Generator yielding post-net refined mel frames of a single
+        utterance while it is still being decoded
+        PARAMS
+        ------
+        inputs: (text, ed) for one utterance
+        chunk_size: decoder steps between post-net updates. The first chunk
+            is ready after chunk_size + PostnetStream.context steps at most
+
+        YIELDS
+        -------
+        mel_outputs_postnet chunks (1, n_mel_channels, n), concatenating to
+        the mel_outputs_postnet of inference
+        """
+        inputs, ed = inputs
+        ed = self.select_ed(ed)
+        embedded_inputs = self.embedding(inputs).transpose(1, 2)
+        encoder_outputs = self.encoder.inference(embedded_inputs)
+        encoder_outputs = self.combine_ed(encoder_outputs, ed)
+
+        postnet_stream = PostnetStream(self.postnet)
+        mel_outputs = []
+        decoder_steps = self.decoder.inference_steps(encoder_outputs)
+        finished = False
+        while not finished:
+            for mel_output, _, _ in decoder_steps:
+                # workspace outputs are views, clone before the next step
+                mel_outputs += [mel_output.clone()]
+                if len(mel_outputs) == chunk_size:
+                    break
+            else:
+                finished = True
+
+            if len(mel_outputs) > 0:
+                mel_chunk = torch.stack(mel_outputs, dim=2).view(
+                    1, self.n_mel_channels, -1)
+                mel_outputs = []
+                mel_outputs_postnet = postnet_stream.push(mel_chunk)
+                if mel_outputs_postnet.size(2) > 0:
+                    yield mel_outputs_postnet
+
+        yield postnet_stream.flush()
+
+    def inference_batch(self, inputs):
+        """ Decodes several utterances in one pass
+        PARAMS
+        ------
+        inputs: (text_padded, ed_padded, input_lengths)
+
+        RETURNS
+        -------
+        list with one [mel_outputs, mel_outputs_postnet, alignments] per
+        utterance, trimmed to its own output and input length
+        """
+        outputs, mel_lengths = self._inference(inputs)
+        return self._split_outputs(outputs, mel_lengths, inputs[2])
+
+    def inference_sweep(self, inputs):
+        """ Decodes one text at several emotion intensities, encoding the
+        text once and decoding all intensities as one batch against the
+        shared encoder outputs
+        PARAMS
+        ------
+        inputs: (text, eds), text (1, T_in) and eds the K intensity settings,
+            (K, 12, T_in) or (K, 12) for intensities constant over the text
+
+        RETURNS
+        -------
+        list with one [mel_outputs, mel_outputs_postnet, alignments] per
+        intensity setting, trimmed to its own output length
+        """
+        inputs, eds = inputs
+        if eds.dim() == 2:
+            eds = eds.unsqueeze(2).expand(-1, -1, inputs.size(1))
+        eds = self.select_ed(eds)
+        embedded_inputs = self.embedding(inputs).transpose(1, 2)
+        encoder_outputs = self.encoder.inference(embedded_inputs)
+        encoder_outputs = encoder_outputs.expand(eds.size(0), -1, -1)
+        encoder_outputs = self.combine_ed(encoder_outputs, eds)
+
+        outputs, mel_lengths = self._decode(encoder_outputs)
+        return self._split_outputs(outputs, mel_lengths)
+
+    def _split_outputs(self, outputs, mel_lengths, input_lengths=None):
+        mel_outputs, mel_outputs_postnet, _, alignments = outputs
+        results = []
+        for i in range(mel_outputs.size(0)):
+            out_len = int(mel_lengths[i])
+            in_len = alignments.size(2) if input_lengths is None \
+                else int(input_lengths[i])
+            results.append([mel_outputs[i, :, :out_len],
+                            mel_outputs_postnet[i, :, :out_len],
+                            alignments[i, :out_len, :in_len]])
+        return results
@@ -0,0 +1,225 @@
+from typing import List, Tuple
+
+import torch
+from torch import nn
+from torch.nn import functional as F
+
+
+def mask_from_lengths(lengths: torch.Tensor, max_len: int) -> torch.Tensor:
+    ids = torch.arange(0, max_len, device=lengths.device)
+    return ids.unsqueeze(0) < lengths.unsqueeze(1)
+
+
+class Tacotron2Inference(nn.Module):
+    """ torch.jit.script-able inference graph of a trained Tacotron2.
+
+    Shares the submodules of the eager model, keeps the decoder recurrent
+    state in explicit tuples instead of module attributes and resolves the
+    emotion intensity combination once at construction, so the decoder loop
+    runs without the Python interpreter and the scripted module can be served
+    without the training code.
+    """
+    def __init__(self, model):
+        super(Tacotron2Inference, self).__init__()
+        decoder = model.decoder
+        attention = decoder.attention_layer
+
+        self.embedding = model.embedding
+        self.encoder_convolutions = model.encoder.convolutions
+        self.lstm = model.encoder.lstm
+
+        # how the emotion intensity vector enters the encoder outputs
+        if not model.include_ed:
+            self.ed_mode = "none"
+        elif model.combination == "addition":
+            self.ed_mode = "addition"
+        elif model.concatenation_embedding:
+            self.ed_mode = "concatenation_embedding"
+        else:
+            self.ed_mode = "concatenation"
+        if hasattr(model, 'ed_embedding'):
+            self.ed_embedding = model.ed_embedding
+        else:
+            self.ed_embedding = nn.Identity()
+        self.register_buffer('ed_index', torch.from_numpy(
+            model.ed_bool_list.nonzero()[0]).long())
+
+        self.n_mel_channels = decoder.n_mel_channels
+        self.n_frames_per_step = decoder.n_frames_per_step
+        self.encoder_embedding_dim = decoder.encoder_embedding_dim
+        self.attention_rnn_dim = decoder.attention_rnn_dim
+        self.decoder_rnn_dim = decoder.decoder_rnn_dim
+        self.max_decoder_steps = decoder.max_decoder_steps
+        self.gate_threshold = float(decoder.gate_threshold)
+
+        self.prenet_layers = decoder.prenet.layers
+        self.attention_rnn = decoder.attention_rnn
+        self.query_layer = attention.query_layer
+        self.memory_layer = attention.memory_layer
+        self.v = attention.v
+        self.location_layer = attention.location_layer
+        self.decoder_rnn = decoder.decoder_rnn
+        # mel and gate projections fused into one matmul
+        self.register_buffer('projection_weight', torch.cat(
+            (decoder.linear_projection.linear_layer.weight,
+             decoder.gate_layer.linear_layer.weight), dim=0).t().contiguous())
+        self.register_buffer('projection_bias', torch.cat(
+            (decoder.linear_projection.linear_layer.bias,
+             decoder.gate_layer.linear_layer.bias), dim=0))
+
+        self.postnet_convolutions = model.postnet.convolutions
+
+    def encode(self, text: torch.Tensor, ed: torch.Tensor,
+               input_lengths: torch.Tensor) -> torch.Tensor:
+        x = self.embedding(text).transpose(1, 2)
+        mask = mask_from_lengths(input_lengths, x.size(2)).unsqueeze(1).to(x.dtype)
+        for conv in self.encoder_convolutions:
+            x = F.relu(conv(x * mask))
+        x = x.transpose(1, 2)
+
+        packed = nn.utils.rnn.pack_padded_sequence(
+            x, input_lengths.cpu(), batch_first=True, enforce_sorted=False)
+        packed_outputs, _ = self.lstm(packed)
+        outputs, _ = nn.utils.rnn.pad_packed_sequence(
+            packed_outputs, batch_first=True, total_length=x.size(1))
+
+        ed = ed.index_select(1, self.ed_index).transpose(1, 2)
+        if self.ed_mode == "addition":
+            outputs = outputs + self.ed_embedding(ed)
+        elif self.ed_mode == "concatenation":
+            outputs = torch.cat([outputs, ed], dim=2)
+        elif self.ed_mode == "concatenation_embedding":
+            outputs = torch.cat([outputs, self.ed_embedding(ed)], dim=2)
+        return outputs
+
+    def prenet(self, x: torch.Tensor) -> torch.Tensor:
+        for linear in self.prenet_layers:
+            x = F.dropout(F.relu(linear(x)), p=0.5, training=True)
+        return x
+
+    def decode(self, decoder_input: torch.Tensor, memory: torch.Tensor,
+               processed_memory: torch.Tensor, mask: torch.Tensor,
+               state: Tuple[torch.Tensor, torch.Tensor, torch.Tensor,
+                            torch.Tensor, torch.Tensor, torch.Tensor,
+                            torch.Tensor]
+               ) -> Tuple[torch.Tensor, Tuple[torch.Tensor, torch.Tensor,
+                                              torch.Tensor, torch.Tensor,
+                                              torch.Tensor, torch.Tensor,
+                                              torch.Tensor]]:
+        """ One decoder step, state is (attention_hidden, attention_cell,
+        decoder_hidden, decoder_cell, attention_weights,
+        attention_weights_cum, attention_context)
+        """
+        (attention_hidden, attention_cell, decoder_hidden, decoder_cell,
+         attention_weights, attention_weights_cum, attention_context) = state
+
+        cell_input = torch.cat((decoder_input, attention_context), -1)
+        attention_hidden, attention_cell = self.attention_rnn(
+            cell_input, (attention_hidden, attention_cell))
+
+        attention_weights_cat = torch.stack(
+            (attention_weights, attention_weights_cum), dim=1)
+        processed_query = self.query_layer(attention_hidden.unsqueeze(1))
+        processed_attention_weights = self.location_layer(attention_weights_cat)
+        energies = self.v(torch.tanh(
+            processed_query + processed_attention_weights + processed_memory))
+        energies = energies.squeeze(-1).masked_fill(~mask, -float("inf"))
+        attention_weights = F.softmax(energies, dim=1)
+        attention_context = torch.bmm(
+            attention_weights.unsqueeze(1), memory).squeeze(1)
+        attention_weights_cum = attention_weights_cum + attention_weights
+
+        decoder_input = torch.cat((attention_hidden, attention_context), -1)
+        decoder_hidden, decoder_cell = self.decoder_rnn(
+            decoder_input, (decoder_hidden, decoder_cell))
+
+        projection = torch.addmm(
+            self.projection_bias,
+            torch.cat((decoder_hidden, attention_context), dim=1),
+            self.projection_weight)
+
+        return projection, (attention_hidden, attention_cell, decoder_hidden,
+                            decoder_cell, attention_weights,
+                            attention_weights_cum, attention_context)
+
+    def postnet(self, x: torch.Tensor, output_lengths: torch.Tensor
+                ) -> torch.Tensor:
+        mask = mask_from_lengths(output_lengths, x.size(2)).unsqueeze(1).to(x.dtype)
+        n_convolutions = len(self.postnet_convolutions)
+        for i, conv in enumerate(self.postnet_convolutions):
+            x = conv(x * mask)
+            if i < n_convolutions - 1:
+                x = torch.tanh(x)
+        return x
+
+    def forward(self, text: torch.Tensor, ed: torch.Tensor,
+                input_lengths: torch.Tensor
+                ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor,
+                           torch.Tensor]:
+        """
+        PARAMS
+        ------
+        text: padded symbol ids (B, T_in)
+        ed: padded emotion intensity channels (B, 12, T_in)
+        input_lengths: text lengths (B,)
+
+        RETURNS
+        -------
+        mel_outputs: (B, n_mel_channels, T_out)
+        mel_outputs_postnet: (B, n_mel_channels, T_out)
+        alignments: (B, T_out, T_in)
+        mel_lengths: frames decoded for each row before its gate fired
+        """
+        memory = self.encode(text, ed, input_lengths)
+        processed_memory = self.memory_layer(memory)
+        mask = mask_from_lengths(input_lengths, memory.size(1))
+
+        B = memory.size(0)
+        n_mel = self.n_mel_channels * self.n_frames_per_step
+        state = (memory.new_zeros(B, self.attention_rnn_dim),
+                 memory.new_zeros(B, self.attention_rnn_dim),
+                 memory.new_zeros(B, self.decoder_rnn_dim),
+                 memory.new_zeros(B, self.decoder_rnn_dim),
+                 memory.new_zeros(B, memory.size(1)),
+                 memory.new_zeros(B, memory.size(1)),
+                 memory.new_zeros(B, self.encoder_embedding_dim))
+
+        mel_lengths = torch.zeros(B, dtype=torch.long, device=memory.device)
+        not_finished = torch.ones(B, dtype=torch.bool, device=memory.device)
+        mel_outputs: List[torch.Tensor] = []
+        alignments: List[torch.Tensor] = []
+
+        decoder_input = memory.new_zeros(B, n_mel)
+        for _ in range(self.max_decoder_steps):
+            projection, state = self.decode(
+                self.prenet(decoder_input), memory, processed_memory, mask,
+                state)
+            decoder_input = projection[:, :n_mel]
+            mel_outputs.append(decoder_input)
+            alignments.append(state[4])
+
+            mel_lengths += not_finished.long()
+            not_finished = not_finished & (
+                torch.sigmoid(projection[:, n_mel]) <= self.gate_threshold)
+            if not bool(not_finished.any()):
+                break
+        if bool(not_finished.any()):
+            print("Warning! Reached max decoder steps")
+
+        mel_outputs_ = torch.stack(mel_outputs, dim=1).view(
+            B, -1, self.n_mel_channels).transpose(1, 2)
+        alignments_ = torch.stack(alignments, dim=1)
+
+        mel_outputs_postnet = mel_outputs_ + self.postnet(
+            mel_outputs_, mel_lengths)
+        padding = ~mask_from_lengths(mel_lengths, mel_outputs_.size(2))
+        padding = padding.unsqueeze(1)
+        mel_outputs_ = mel_outputs_.masked_fill(padding, 0.0)
+        mel_outputs_postnet = mel_outputs_postnet.masked_fill(padding, 0.0)
+
+        return mel_outputs_, mel_outputs_postnet, alignments_, mel_lengths
+
+
+def script_model(model):
+    """ Scripts the inference graph of an eval-mode Tacotron2 """
+    return torch.jit.script(Tacotron2Inference(model.eval()))
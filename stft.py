@@ -35,20 +35,49 @@ import numpy as np
 import torch.nn.functional as F
 from torch.autograd import Variable
 from scipy.signal import get_window
-from librosa.util import pad_center, tiny
-from audio_processing import window_sumsquare
+from librosa.util import pad_center
+from audio_processing import cached_window_sumsquare
+
+# conv1d picks another algorithm for short inputs, which rounds differently,
+# so shorter inputs are zero-padded to this many frames to give the same
+# values per frame as long ones (a streamed wave matches the one-shot call)
+MIN_CONV_FRAMES = 128
 
 
 class STFT(torch.nn.Module):
-    """adapted from Prem Seetharaman's https://github.com/pseeth/pytorch-stft"""
+    """adapted from Prem Seetharaman's https://github.com/pseeth/pytorch-stft
+
+    backend 'fft' runs torch.stft/torch.istft, 'conv' the original
+    convolution with a dense Fourier basis and its pseudo-inverse. Both give
+    the same magnitudes, phases and reconstructions up to float precision,
+    the FFT is O(N log N) per frame instead of O(N^2).
+    """
     def __init__(self, filter_length=800, hop_length=200, win_length=800,
-                 window='hann'):
+                 window='hann', backend='fft'):
         super(STFT, self).__init__()
+        if backend not in ('fft', 'conv'):
+            raise ValueError("Unknown STFT backend '{}', expected 'fft' or "
+                             "'conv'".format(backend))
         self.filter_length = filter_length
         self.hop_length = hop_length
         self.win_length = win_length
         self.window = window
+        self.backend = backend
         self.forward_transform = None
+
+        if window is not None:
+            assert(filter_length >= win_length)
+            # get window and zero center pad it to filter_length
+            fft_window = get_window(window, win_length, fftbins=True)
+            fft_window = pad_center(fft_window, size=filter_length)
+            fft_window = torch.from_numpy(fft_window).float()
+        else:
+            fft_window = torch.ones(filter_length)
+
+        if backend == 'fft':
+            self.register_buffer('fft_window', fft_window)
+            return
+
         scale = self.filter_length / self.hop_length
         fourier_basis = np.fft.fft(np.eye(self.filter_length))
 
@@ -61,12 +90,6 @@ class STFT(torch.nn.Module):
             np.linalg.pinv(scale * fourier_basis).T[:, None, :])
 
         if window is not None:
-            assert(filter_length >= win_length)
-            # get window and zero center pad it to filter_length
-            fft_window = get_window(window, win_length, fftbins=True)
-            fft_window = pad_center(fft_window, filter_length)
-            fft_window = torch.from_numpy(fft_window).float()
-
             # window the bases
             forward_basis *= fft_window
             inverse_basis *= fft_window
@@ -74,7 +97,37 @@ class STFT(torch.nn.Module):
         self.register_buffer('forward_basis', forward_basis.float())
         self.register_buffer('inverse_basis', inverse_basis.float())
 
-    def transform(self, input_data):
+    def transform(self, input_data, center=True):
+        """ center: reflect-pad filter_length // 2 samples on both sides so
+        frame t is centered on sample t * hop_length, as librosa does. Without
+        it frame t starts at sample t * hop_length and there are
+        (n_samples - filter_length) // hop_length + 1 frames """
+        if self.backend == 'fft':
+            spectrum = self.complex_transform(input_data, center)
+            return spectrum.abs(), spectrum.angle()
+
+        real_part, imag_part = self._conv_transform(input_data, center)
+        magnitude = torch.sqrt(real_part**2 + imag_part**2)
+        phase = torch.autograd.Variable(
+            torch.atan2(imag_part.data, real_part.data))
+
+        return magnitude, phase
+
+    def complex_transform(self, input_data, center=True):
+        """ complex (B, filter_length / 2 + 1, T) spectrum, skips the
+        magnitude and phase split for callers that work on the complex
+        values (Griffin-Lim) """
+        if self.backend == 'fft':
+            self.num_samples = input_data.size(1)
+            # reflect-pads like the convolution path below
+            return torch.stft(
+                input_data, self.filter_length, hop_length=self.hop_length,
+                window=self.fft_window, center=center, pad_mode='reflect',
+                return_complex=True)
+
+        return torch.complex(*self._conv_transform(input_data, center))
+
+    def _conv_transform(self, input_data, center=True):
         num_batches = input_data.size(0)
         num_samples = input_data.size(1)
 
@@ -82,31 +135,51 @@ class STFT(torch.nn.Module):
 
         # similar to librosa, reflect-pad the input
         input_data = input_data.view(num_batches, 1, num_samples)
-        input_data = F.pad(
-            input_data.unsqueeze(1),
-            (int(self.filter_length / 2), int(self.filter_length / 2), 0, 0),
-            mode='reflect')
-        input_data = input_data.squeeze(1)
+        if center:
+            input_data = F.pad(
+                input_data.unsqueeze(1),
+                (int(self.filter_length / 2), int(self.filter_length / 2), 0, 0),
+                mode='reflect')
+            input_data = input_data.squeeze(1)
+
+        n_frames = (input_data.size(-1) - self.filter_length) // self.hop_length + 1
+        min_samples = self.filter_length + (MIN_CONV_FRAMES - 1) * self.hop_length
+        if input_data.size(-1) < min_samples:
+            input_data = F.pad(input_data, (0, min_samples - input_data.size(-1)))
 
         forward_transform = F.conv1d(
             input_data,
             Variable(self.forward_basis, requires_grad=False),
             stride=self.hop_length,
             padding=0)
+        forward_transform = forward_transform[:, :, :n_frames]
 
         cutoff = int((self.filter_length / 2) + 1)
         real_part = forward_transform[:, :cutoff, :]
         imag_part = forward_transform[:, cutoff:, :]
+        return real_part, imag_part
 
-        magnitude = torch.sqrt(real_part**2 + imag_part**2)
-        phase = torch.autograd.Variable(
-            torch.atan2(imag_part.data, real_part.data))
+    def inverse(self, magnitude, phase):
+        if self.backend == 'fft':
+            return self.complex_inverse(torch.polar(magnitude, phase))
 
-        return magnitude, phase
+        return self._conv_inverse(
+            magnitude*torch.cos(phase), magnitude*torch.sin(phase))
 
-    def inverse(self, magnitude, phase):
-        recombine_magnitude_phase = torch.cat(
-            [magnitude*torch.cos(phase), magnitude*torch.sin(phase)], dim=1)
+    def complex_inverse(self, spectrum):
+        """ (B, 1, samples) signal of a complex spectrum """
+        if self.backend == 'fft':
+            # istft divides by the window sum-square envelope and trims the
+            # padding just like the convolution path below
+            inverse_transform = torch.istft(
+                spectrum, self.filter_length, hop_length=self.hop_length,
+                window=self.fft_window, center=True)
+            return inverse_transform.unsqueeze(1)
+
+        return self._conv_inverse(spectrum.real, spectrum.imag)
+
+    def _conv_inverse(self, real_part, imag_part):
+        recombine_magnitude_phase = torch.cat([real_part, imag_part], dim=1)
 
         inverse_transform = F.conv_transpose1d(
             recombine_magnitude_phase,
@@ -115,17 +188,11 @@ class STFT(torch.nn.Module):
             padding=0)
 
         if self.window is not None:
-            window_sum = window_sumsquare(
-                self.window, magnitude.size(-1), hop_length=self.hop_length,
-                win_length=self.win_length, n_fft=self.filter_length,
-                dtype=np.float32)
             # remove modulation effects
-            approx_nonzero_indices = torch.from_numpy(
-                np.where(window_sum > tiny(window_sum))[0])
-            window_sum = torch.autograd.Variable(
-                torch.from_numpy(window_sum), requires_grad=False)
-            window_sum = window_sum.cuda() if magnitude.is_cuda else window_sum
-            inverse_transform[:, :, approx_nonzero_indices] /= window_sum[approx_nonzero_indices]
+            window_sum, _ = cached_window_sumsquare(
+                self.window, real_part.size(-1), self.hop_length,
+                self.win_length, self.filter_length, real_part.device)
+            inverse_transform /= window_sum
 
             # scale by hop ratio
             inverse_transform *= float(self.filter_length) / self.hop_length
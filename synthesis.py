@@ -0,0 +1,174 @@
+import re
+
+import torch
+
+from text import text_to_sequence
+from text.cleaners import _abbreviation_pairs
+from text.symbols import _punctuation
+from vocoder import GriffinLim
+
+
+# sentence ends split first, clause marks only when a sentence is too long
+_sentence_end_re = re.compile(
+    r'(?<=[{}])\s+'.format(re.escape(''.join(
+        p for p in _punctuation if p in '.!?'))))
+_clause_end_re = re.compile(
+    r'(?<=[{}])\s+'.format(re.escape(''.join(
+        p for p in _punctuation if p in ',:;'))))
+# a period after one of these is not a sentence end ("Mr. Smith")
+_abbreviation_end_re = re.compile(
+    r'\b({})\.$'.format('|'.join(x[0] for x in _abbreviation_pairs)),
+    re.IGNORECASE)
+
+
+def _split_sentences(text):
+    sentences = []
+    for piece in _sentence_end_re.split(text):
+        if sentences and _abbreviation_end_re.search(sentences[-1]):
+            sentences[-1] += ' ' + piece
+        else:
+            sentences.append(piece)
+    return sentences
+
+
+def _pack(pieces, max_chars):
+    # joins consecutive pieces while they fit in max_chars
+    chunks, current = [], ''
+    for piece in pieces:
+        if current and len(current) + 1 + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = piece if not current else current + ' ' + piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _split_long(text, max_chars):
+    # last resort for clauses without punctuation: break between words
+    return _pack(text.split(), max_chars)
+
+
+def split_text(text, max_chars=150):
+    """Splits long-form text into chunks of at most max_chars characters at
+    sentence boundaries, then clause boundaries, then spaces. Periods after
+    the abbreviations of text.cleaners do not end a sentence. Consecutive
+    sentences, and consecutive clauses of one sentence, are packed together
+    while they fit.
+    """
+    chunks, sentences = [], []
+    for sentence in _split_sentences(text.strip()):
+        if len(sentence) <= max_chars:
+            sentences.append(sentence)
+            continue
+        # a sentence too long for one chunk is split on its own
+        chunks.extend(_pack(sentences, max_chars))
+        sentences = []
+        clauses = []
+        for clause in _clause_end_re.split(sentence):
+            if len(clause) > max_chars:
+                chunks.extend(_pack(clauses, max_chars))
+                clauses = []
+                chunks.extend(_split_long(clause, max_chars))
+            else:
+                clauses.append(clause)
+        chunks.extend(_pack(clauses, max_chars))
+    chunks.extend(_pack(sentences, max_chars))
+    return [chunk for chunk in chunks if chunk]
+
+
+def crossfade_concatenate(segments, n_overlap):
+    """Concatenates segments along their last dimension, overlapping
+    consecutive segments by n_overlap samples with a linear crossfade"""
+    output = segments[0]
+    for segment in segments[1:]:
+        n = min(n_overlap, output.size(-1), segment.size(-1))
+        if n == 0:
+            output = torch.cat((output, segment), dim=-1)
+            continue
+        fade_in = torch.linspace(0, 1, n + 2, device=segment.device)[1:-1]
+        overlap = output[..., -n:] * (1 - fade_in) + segment[..., :n] * fade_in
+        output = torch.cat((output[..., :-n], overlap, segment[..., n:]), dim=-1)
+    return output
+
+
+def mel_to_audio(mel, stft, n_iters=30, mel_mean_std=None):
+    """Griffin-Lim waveform of a single (n_mel_channels, T) mel-spectrogram
+    PARAMS
+    ------
+    mel: log mel-spectrogram as predicted by Tacotron2
+    stft: layers.TacotronSTFT matching the training features
+    mel_mean_std: statistics used when the model was trained with
+        normalize_mel, None otherwise
+    """
+    vocoder = GriffinLim(stft, n_iters, mel_mean_std=mel_mean_std)
+    audio, _ = vocoder(mel.unsqueeze(0))
+    return audio.squeeze(0)
+
+
+def mels_to_audio(mels, stft, n_iters=30, mel_mean_std=None):
+    """Griffin-Lim waveforms of a list of (n_mel_channels, T_i) mels,
+    vocoded as one padded batch"""
+    mel_lengths = torch.LongTensor([mel.size(1) for mel in mels])
+    mel_padded = mels[0].new_zeros(
+        len(mels), mels[0].size(0), int(mel_lengths.max()))
+    for i, mel in enumerate(mels):
+        mel_padded[i, :, :mel.size(1)] = mel
+    vocoder = GriffinLim(stft, n_iters, mel_mean_std=mel_mean_std)
+    audio, audio_lengths = vocoder(mel_padded, mel_lengths)
+    return [audio[i, :audio_lengths[i]] for i in range(len(mels))]
+
+
+def synthesize_long_form(model, text, ed, text_cleaners=['english_cleaners'],
+                         max_chars=150, batch_size=8, crossfade_frames=4,
+                         stft=None, griffin_lim_iters=30, mel_mean_std=None):
+    """Synthesizes text of any length: splits it at sentence and clause
+    boundaries, decodes the chunks in length-sorted batches with
+    Tacotron2.inference_batch and joins them with short crossfades.
+
+    PARAMS
+    ------
+    model: eval-mode Tacotron2
+    text: raw text
+    ed: emotion intensity (12,) applied to every symbol
+    max_chars: longest chunk, keep it well within max_decoder_steps frames
+    batch_size: chunks decoded per forward pass
+    crossfade_frames: overlap between consecutive chunks in mel frames
+    stft: TacotronSTFT, when given the chunks are vocoded with Griffin-Lim
+        and the waveforms are joined instead of the mels
+
+    RETURNS
+    -------
+    mel_outputs_postnet (n_mel_channels, T) or waveform (T,) if stft is given
+    """
+    chunks = split_text(text, max_chars)
+    sequences = [torch.LongTensor(text_to_sequence(chunk, text_cleaners))
+                 for chunk in chunks]
+    order = sorted(range(len(sequences)), key=lambda i: len(sequences[i]),
+                   reverse=True)
+    device = next(model.parameters()).device
+    ed = torch.as_tensor(ed).float().view(-1, 1).to(device)
+
+    mels = [None] * len(sequences)
+    with torch.no_grad():
+        for b in range(0, len(order), batch_size):
+            batch = order[b:b + batch_size]
+            input_lengths = torch.LongTensor([len(sequences[i]) for i in batch])
+            text_padded = torch.zeros(
+                len(batch), int(input_lengths.max()), dtype=torch.long)
+            for row, i in enumerate(batch):
+                text_padded[row, :len(sequences[i])] = sequences[i]
+            ed_padded = ed.unsqueeze(0).expand(
+                len(batch), -1, text_padded.size(1))
+            outputs = model.inference_batch(
+                (text_padded.to(device), ed_padded, input_lengths.to(device)))
+            for i, (_, mel_outputs_postnet, _) in zip(batch, outputs):
+                mels[i] = mel_outputs_postnet.float().cpu()
+
+    if stft is None:
+        return crossfade_concatenate(mels, crossfade_frames)
+
+    audios = mels_to_audio(mels, stft, griffin_lim_iters, mel_mean_std)
+    return crossfade_concatenate(
+        audios, crossfade_frames * stft.stft_fn.hop_length)
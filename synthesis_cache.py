@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import torch
+
+
+def checkpoint_hash(checkpoint_path=None, model=None):
+    """sha1 of a checkpoint file, or of the model parameters when no file is
+    given"""
+    sha = hashlib.sha1()
+    if checkpoint_path is not None:
+        with open(checkpoint_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+    else:
+        for name, tensor in model.state_dict().items():
+            sha.update(name.encode())
+            sha.update(tensor.detach().cpu().numpy().tobytes())
+    return sha.hexdigest()
+
+
+def hparams_hash(hparams):
+    # tf HParams exposes its values through values(), HParams is a dict
+    values = dict(hparams) if isinstance(hparams, dict) else hparams.values()
+    dump = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha1(dump.encode()).hexdigest()
+
+
+def _update_tensor(sha, tensor):
+    if tensor is None:
+        sha.update(b'none')
+        return
+    tensor = torch.as_tensor(tensor).detach().cpu().contiguous()
+    sha.update(str((tuple(tensor.shape), str(tensor.dtype))).encode())
+    sha.update(tensor.numpy().tobytes())
+
+
+class SynthesisCache(object):
+    """ Caches Tacotron2.inference outputs.
+
+    Entries are keyed by the symbol sequence (the text_to_sequence output),
+    the ED/SP conditioning, the hparams, the checkpoint and the dropout seed.
+    Prenet dropout stays active at inference, so every miss is decoded with
+    the torch RNG seeded from `seed`, which makes the cached output the one
+    the model would produce for that key. Lookups go through an in-memory LRU
+    tier and then, if cache_dir is set, an on-disk tier capped at
+    max_disk_bytes where the least recently used files are evicted first.
+    """
+    def __init__(self, model, hparams, checkpoint_path=None, max_entries=256,
+                 cache_dir=None, max_disk_bytes=1 << 30, seed=None):
+        self.model = model
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.seed = hparams.seed if seed is None else seed
+        self.prefix = hashlib.sha1('{}:{}:{}'.format(
+            checkpoint_hash(checkpoint_path, model), hparams_hash(hparams),
+            self.seed).encode()).digest()
+
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, text, ed, sp=None):
+        sha = hashlib.sha1(self.prefix)
+        _update_tensor(sha, text)
+        _update_tensor(sha, ed)
+        _update_tensor(sha, sp)
+        return sha.hexdigest()
+
+    def inference(self, inputs, sp=None):
+        """ Drop-in for Tacotron2.inference
+        PARAMS
+        ------
+        inputs: (text, ed) as passed to Tacotron2.inference, text being the
+            text_to_sequence output
+        sp: optional SP conditioning, only part of the key
+
+        RETURNS
+        -------
+        mel_outputs, mel_outputs_postnet, gate_outputs, alignments
+        """
+        key = self.key(inputs[0], inputs[1], sp)
+        device = next(self.model.parameters()).device
+
+        outputs = self.memory.get(key)
+        if outputs is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+        else:
+            outputs = self._load(key)
+            if outputs is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                outputs = self._decode(inputs, device)
+                self._save(key, outputs)
+            self._remember(key, outputs)
+
+        return [output.to(device, copy=True) for output in outputs]
+
+    def stats(self):
+        return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'entries': len(self.memory)}
+
+    def clear(self):
+        self.memory.clear()
+        if self.cache_dir is not None:
+            for filename in os.listdir(self.cache_dir):
+                if filename.endswith('.pt'):
+                    os.remove(os.path.join(self.cache_dir, filename))
+
+    def _decode(self, inputs, device):
+        devices = [device.index or 0] if device.type == 'cuda' else []
+        with torch.random.fork_rng(devices=devices), torch.no_grad():
+            torch.manual_seed(self.seed)
+            outputs = self.model.inference(inputs)
+        return [output.detach().cpu() for output in outputs]
+
+    def _remember(self, key, outputs):
+        self.memory[key] = outputs
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pt')
+
+    def _load(self, key):
+        if self.cache_dir is None or not os.path.exists(self._path(key)):
+            return None
+        try:
+            outputs = torch.load(self._path(key), map_location='cpu')
+        except Exception:
+            # partially written or corrupt entry, decode it again
+            os.remove(self._path(key))
+            return None
+        # mtime marks the last use, used for eviction
+        os.utime(self._path(key))
+        return outputs
+
+    def _save(self, key, outputs):
+        if self.cache_dir is None:
+            return
+        tmp_path = self._path(key) + '.tmp'
+        torch.save(outputs, tmp_path)
+        os.replace(tmp_path, self._path(key))
+
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.pt'):
+                stat = os.stat(os.path.join(self.cache_dir, filename))
+                entries.append((stat.st_mtime, stat.st_size, filename))
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, filename))
+            total -= size
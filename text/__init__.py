@@ -1,4 +1,6 @@
 """ from https://github.com/keithito/tacotron """
+import functools
+import multiprocessing
 import re
 from text import cleaners
 from text.symbols import symbols
@@ -53,6 +55,24 @@ def sequence_to_text(sequence):
   return result.replace('}{', ' ')
 
 
+def clean_texts(texts, cleaner_names, n_workers=None, chunksize=256):
+  '''Runs a list of strings through the cleaners across a pool of worker processes.
+
+    Args:
+      texts: list of strings to clean
+      cleaner_names: names of the cleaner functions to run the text through
+      n_workers: number of processes, defaults to the number of cores
+
+    Returns:
+      List of cleaned strings in the order of texts
+  '''
+  clean = functools.partial(_clean_text, cleaner_names=cleaner_names)
+  if n_workers == 1 or len(texts) <= chunksize:
+    return [clean(text) for text in texts]
+  with multiprocessing.Pool(n_workers) as pool:
+    return pool.map(clean, texts, chunksize=chunksize)
+
+
 def _clean_text(text, cleaner_names):
   for name in cleaner_names:
     cleaner = getattr(cleaners, name)
@@ -20,8 +20,8 @@ from .numbers import normalize_numbers
 # Regular expression matching whitespace:
 _whitespace_re = re.compile(r'\s+')
 
-# List of (regular expression, replacement) pairs for abbreviations:
-_abbreviations = [(re.compile('\\b%s\\.' % x[0], re.IGNORECASE), x[1]) for x in [
+# List of (abbreviation, replacement) pairs:
+_abbreviation_pairs = [
   ('mrs', 'misess'),
   ('mr', 'mister'),
   ('dr', 'doctor'),
@@ -40,15 +40,35 @@ _abbreviations = [(re.compile('\\b%s\\.' % x[0], re.IGNORECASE), x[1]) for x in
   ('ltd', 'limited'),
   ('col', 'colonel'),
   ('ft', 'fort'),
-]]
+]
+
+# List of (regular expression, replacement) pairs for abbreviations:
+_abbreviations = [(re.compile('\\b%s\\.' % x[0], re.IGNORECASE), x[1]) for x in _abbreviation_pairs]
 
+# All abbreviations in one pass, the replacement is looked up by the lowercased match:
+_abbreviation_re = re.compile(
+  '\\b(%s)\\.' % '|'.join(x[0] for x in _abbreviation_pairs), re.IGNORECASE)
+_abbreviation_dict = dict(_abbreviation_pairs)
 
-def expand_abbreviations(text):
+
+def _expand_abbreviations_sequential(text):
   for regex, replacement in _abbreviations:
     text = re.sub(regex, replacement, text)
   return text
 
 
+def expand_abbreviations(text):
+  matches = list(_abbreviation_re.finditer(text))
+  if not matches:
+    return text
+  # Replacing an abbreviation removes the word boundary in front of an abbreviation
+  # right after it ("dr.st."), which the sequential passes only match in list order
+  for previous, match in zip(matches, matches[1:]):
+    if previous.end() == match.start():
+      return _expand_abbreviations_sequential(text)
+  return _abbreviation_re.sub(lambda m: _abbreviation_dict[m.group(1).lower()], text)
+
+
 def expand_numbers(text):
   return normalize_numbers(text)
 
@@ -1,5 +1,6 @@
 """ from https://github.com/keithito/tacotron """
 
+import functools
 import inflect
 import re
 
@@ -11,6 +12,7 @@ _pounds_re = re.compile(r'£([0-9\,]*[0-9]+)')
 _dollars_re = re.compile(r'\$([0-9\.\,]*[0-9]+)')
 _ordinal_re = re.compile(r'[0-9]+(st|nd|rd|th)')
 _number_re = re.compile(r'[0-9]+')
+_digit_re = re.compile(r'[0-9]')
 
 
 def _remove_commas(m):
@@ -42,12 +44,21 @@ def _expand_dollars(m):
     return 'zero dollars'
 
 
+@functools.lru_cache(maxsize=8192)
+def _ordinal_to_words(ordinal):
+  return _inflect.number_to_words(ordinal)
+
+
 def _expand_ordinal(m):
-  return _inflect.number_to_words(m.group(0))
+  return _ordinal_to_words(m.group(0))
 
 
 def _expand_number(m):
-  num = int(m.group(0))
+  return _number_to_words(int(m.group(0)))
+
+
+@functools.lru_cache(maxsize=8192)
+def _number_to_words(num):
   if num > 1000 and num < 3000:
     if num == 2000:
       return 'two thousand'
@@ -62,6 +73,9 @@ def _expand_number(m):
 
 
 def normalize_numbers(text):
+  # every pattern below needs a digit
+  if not _digit_re.search(text):
+    return text
   text = re.sub(_comma_number_re, _remove_commas, text)
   text = re.sub(_pounds_re, r'\1 pounds', text)
   text = re.sub(_dollars_re, _expand_dollars, text)
@@ -0,0 +1,76 @@
+""" Persistent cache of the text_to_sequence output of a filelist
+
+Every line of the filelist is cleaned and converted once, in parallel, and
+stored as one flat int16 array of symbol ids with an offsets index. The
+cache file name carries a hash of the filelist contents, the cleaner names
+and the symbol set, so editing any of them builds a new cache and removes
+the stale one. Under distributed training rank 0 builds it and the other
+ranks wait for it.
+"""
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from text import text_to_sequence
+from text.symbols import symbols
+from utils import load_filepaths_and_text, main_process_first, save_npz_atomic
+
+
+def cache_key(filelist, cleaner_names):
+    sha = hashlib.sha1()
+    with open(filelist, 'rb') as f:
+        sha.update(f.read())
+    sha.update(json.dumps(list(cleaner_names)).encode())
+    sha.update('\n'.join(symbols).encode())
+    return sha.hexdigest()[:16]
+
+
+def build_sequences(texts, cleaner_names, n_workers=None):
+    """ (ids, offsets) with the sequence of texts[i] at
+    ids[offsets[i]:offsets[i + 1]] """
+    to_sequence = functools.partial(text_to_sequence,
+                                    cleaner_names=cleaner_names)
+    with multiprocessing.Pool(n_workers) as pool:
+        sequences = pool.map(to_sequence, texts, chunksize=256)
+
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(sequence) for sequence in sequences])
+    ids = np.fromiter((i for sequence in sequences for i in sequence),
+                      dtype=np.int16, count=int(offsets[-1]))
+    return ids, offsets
+
+
+class TextCache(object):
+    """ Symbol id sequences of the lines of a filelist, in filelist order """
+    def __init__(self, filelist, cleaner_names, cache_dir, n_workers=None):
+        with main_process_first():
+            self.load_or_build(filelist, cleaner_names, cache_dir, n_workers)
+
+    def load_or_build(self, filelist, cleaner_names, cache_dir, n_workers):
+        name = os.path.basename(filelist)
+        path = os.path.join(cache_dir, '{}.{}.npz'.format(
+            name, cache_key(filelist, cleaner_names)))
+
+        if os.path.exists(path):
+            with np.load(path) as cache:
+                self.ids, self.offsets = cache['ids'], cache['offsets']
+            return
+
+        texts = [x[1] for x in load_filepaths_and_text(filelist)]
+        self.ids, self.offsets = build_sequences(texts, cleaner_names, n_workers)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        for filename in os.listdir(cache_dir):
+            if filename.startswith(name + '.') and filename.endswith('.npz'):
+                os.remove(os.path.join(cache_dir, filename))
+        save_npz_atomic(path, ids=self.ids, offsets=self.offsets)
+
+    def __getitem__(self, index):
+        return self.ids[self.offsets[index]:self.offsets[index + 1]]
+
+    def __len__(self):
+        return len(self.offsets) - 1
@@ -2,6 +2,7 @@ import os
 import time
 import argparse
 import math
+import numpy as np
 from numpy import finfo
 
 import torch
@@ -10,7 +11,8 @@ import torch.distributed as dist
 from torch.utils.data.distributed import DistributedSampler
 from torch.utils.data import DataLoader
 
-from data_utils import TextMelLoader, TextMelCollate
+from data_utils import TextMelLoader, TextMelCollate, BucketBatchSampler, \
+    BatchPrefetcher
 from loss_function import Tacotron2Loss
 # from logger import Tacotron2Logger
 # from hparams import create_hparams
@@ -46,7 +48,29 @@ def prepare_dataloaders(hparams):
     # Get data, data loaders and collate function ready
     trainset = TextMelLoader(hparams.training_files, hparams)
     valset = TextMelLoader(hparams.validation_files, hparams)
-    collate_fn = TextMelCollate(hparams.n_frames_per_step)
+    collate_fn = TextMelCollate(
+        hparams.n_frames_per_step,
+        np.array(hparams.phones_words_utterance).repeat(4))
+
+    loader_kwargs = dict(num_workers=hparams.num_workers,
+                         pin_memory=torch.cuda.is_available(),
+                         collate_fn=collate_fn)
+    if hparams.num_workers > 0:
+        loader_kwargs.update(prefetch_factor=hparams.prefetch_factor,
+                             persistent_workers=hparams.persistent_workers)
+
+    if hparams.bucket_batches > 0:
+        if hparams.distributed_run:
+            num_replicas, rank = dist.get_world_size(), dist.get_rank()
+        else:
+            num_replicas, rank = 1, 0
+        batch_sampler = BucketBatchSampler(
+            trainset.get_mel_lengths(), hparams.batch_size,
+            hparams.bucket_batches, num_replicas=num_replicas, rank=rank,
+            seed=hparams.seed, drop_last=True)
+        train_loader = DataLoader(trainset, batch_sampler=batch_sampler,
+                                  **loader_kwargs)
+        return train_loader, valset, collate_fn
 
     if hparams.distributed_run:
         train_sampler = DistributedSampler(trainset)
@@ -54,11 +78,9 @@ def prepare_dataloaders(hparams):
     else:
         train_sampler = None
         shuffle = True
-    shuffle=False
-    train_loader = DataLoader(trainset, num_workers=1, shuffle=shuffle,
-                              sampler=train_sampler,
-                              batch_size=hparams.batch_size, pin_memory=False,
-                              drop_last=True, collate_fn=collate_fn)
+    train_loader = DataLoader(trainset, shuffle=shuffle, sampler=train_sampler,
+                              batch_size=hparams.batch_size, drop_last=True,
+                              **loader_kwargs)
     return train_loader, valset, collate_fn
 
 
@@ -208,13 +230,26 @@ def train(output_directory, log_directory, checkpoint_path, warm_start, n_gpus,
     # ================ MAIN TRAINNIG LOOP! ===================
     for epoch in range(epoch_offset, hparams.epochs):
         print("Epoch: {}".format(epoch))
-        for i, batch in enumerate(train_loader):
+        sampler = train_loader.batch_sampler \
+            if hparams.bucket_batches > 0 else train_loader.sampler
+        if hasattr(sampler, 'set_epoch'):
+            sampler.set_epoch(epoch)
+        real_frames, padded_frames, data_wait = 0, 0, 0.0
+        batches = BatchPrefetcher(
+            train_loader, model.parse_batch, hparams.prefetch_batches)
+        for i, (x, y) in enumerate(batches):
             start = time.perf_counter()
+            # real mel frames over padded frames, the share of useful decoder steps
+            output_lengths, mel_padded = x[4], x[2]
+            padding_efficiency = output_lengths.sum().item() / (
+                mel_padded.size(0) * mel_padded.size(2))
+            data_wait += batches.wait_time
+            real_frames += output_lengths.sum().item()
+            padded_frames += mel_padded.size(0) * mel_padded.size(2)
             for param_group in optimizer.param_groups:
                 param_group['lr'] = learning_rate
 
             model.zero_grad()
-            x, y = model.parse_batch(batch)
             y_pred = model(x)
 
             loss = criterion(y_pred, y)
@@ -240,8 +275,10 @@ def train(output_directory, log_directory, checkpoint_path, warm_start, n_gpus,
 
             if not is_overflow and rank == 0:
                 duration = time.perf_counter() - start
-                print("Train loss {} {:.6f} Grad Norm {:.6f} {:.2f}s/it".format(
-                    iteration, reduced_loss, grad_norm, duration))
+                print("Train loss {} {:.6f} Grad Norm {:.6f} {:.2f}s/it "
+                      "Data wait {:.3f}s Padding efficiency {:.3f}".format(
+                          iteration, reduced_loss, grad_norm, duration,
+                          batches.wait_time, padding_efficiency))
                 # logger.log_training(
                 #     reduced_loss, grad_norm, learning_rate, duration, iteration)
 
@@ -257,6 +294,10 @@ def train(output_directory, log_directory, checkpoint_path, warm_start, n_gpus,
 
             iteration += 1
 
+        if rank == 0 and padded_frames > 0:
+            print("Epoch {} padding efficiency {:.3f} data wait {:.1f}s".format(
+                epoch, real_frames / padded_frames, data_wait))
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
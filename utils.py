@@ -1,18 +1,52 @@
+import contextlib
+import functools
+import math
+import os
+import tempfile
+
 import numpy as np
 from scipy.io.wavfile import read
+from scipy.signal import firwin, resample_poly
 import torch
+import torch.distributed as dist
 
 
 def get_mask_from_lengths(lengths):
     max_len = torch.max(lengths).item()
-    ids = torch.arange(0, max_len, out=torch.cuda.LongTensor(max_len))
+    ids = torch.arange(0, max_len, device=lengths.device)
     mask = (ids < lengths.unsqueeze(1)).bool()
     return mask
 
 
-def load_wav_to_torch(full_path):
-    sampling_rate, data = read(full_path)
-    return torch.FloatTensor(data.astype(np.float32)), sampling_rate
+@functools.lru_cache(maxsize=16)
+def resample_kernel(orig_sr, target_sr):
+    """ The low-pass FIR filter resample_poly designs for a rate pair, built
+    once per pair instead of on every call """
+    gcd = math.gcd(orig_sr, target_sr)
+    max_rate = max(orig_sr, target_sr) // gcd
+    kernel = firwin(20 * max_rate + 1, 1. / max_rate, window=('kaiser', 5.0))
+    return kernel.astype(np.float32)
+
+
+def resample(audio, orig_sr, target_sr):
+    """ Polyphase resampling of a 1-D float32 array, same as
+    resample_poly(audio, up, down) with its default filter """
+    gcd = math.gcd(orig_sr, target_sr)
+    return resample_poly(audio, target_sr // gcd, orig_sr // gcd,
+                         window=resample_kernel(orig_sr, target_sr))
+
+
+def load_wav_to_torch(full_path, target_sampling_rate=None):
+    """ Samples of a wav at their original scale, read through a memory map
+    so the only copy made is the float32 conversion. With
+    target_sampling_rate, audio at another rate is resampled to it and
+    target_sampling_rate is returned as the rate """
+    sampling_rate, data = read(full_path, mmap=True)
+    audio = data.astype(np.float32)
+    if target_sampling_rate is not None and sampling_rate != target_sampling_rate:
+        audio = resample(audio, sampling_rate, target_sampling_rate)
+        sampling_rate = target_sampling_rate
+    return torch.from_numpy(audio), sampling_rate
 
 
 def load_filepaths_and_text(filename, split="|"):
@@ -21,6 +55,36 @@ def load_filepaths_and_text(filename, split="|"):
     return filepaths_and_text
 
 
+@contextlib.contextmanager
+def main_process_first():
+    """ Under distributed training, runs the body on rank 0 first and on the
+    other ranks once it has finished, so a cache it writes is built once and
+    only read by the rest """
+    distributed = dist.is_available() and dist.is_initialized()
+    if distributed and dist.get_rank() != 0:
+        dist.barrier()
+    try:
+        yield
+    finally:
+        if distributed and dist.get_rank() == 0:
+            dist.barrier()
+
+
+def save_npz_atomic(path, **arrays):
+    """ np.savez through a temporary file of its own in the same directory,
+    renamed into place, so readers never see a partial file and concurrent
+    writers do not clobber each other's temporary file """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
 def to_gpu(x):
     x = x.contiguous()
 
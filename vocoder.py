@@ -0,0 +1,157 @@
+""" Batched Griffin-Lim vocoder for Tacotron2 mel outputs
+
+Takes the padded log-mels of Tacotron2.inference / inference_batch, maps
+them to linear magnitudes with the pseudo-inverse of the mel filterbank and
+reconstructs the phase of the whole batch at once with the fast Griffin-Lim
+momentum update (Perraudin et al., 2013). Each item stops iterating when its
+spectral convergence stops improving, the rest of the batch carries on.
+"""
+import math
+
+import torch
+
+from audio_processing import dynamic_range_decompression
+
+
+def mel_gram_inverse(mel_basis):
+    """ pinv(M M^T) of the (n_mel_channels, n_freq) filterbank M. pinv(M) =
+    M^T pinv(M M^T), so the mel inversion is this small matrix followed by
+    the banded TacotronSTFT.mel_transpose """
+    mel_basis = mel_basis.double()
+    gram = torch.matmul(mel_basis, mel_basis.t())
+    return torch.linalg.pinv(gram).float()
+
+
+def spectral_convergence(magnitudes, rebuilt):
+    """ ||S - |X|||_F / ||S||_F per batch item """
+    return (torch.norm((magnitudes - rebuilt).flatten(1), dim=1) /
+            torch.norm(magnitudes.flatten(1), dim=1).clamp(min=1e-8))
+
+
+class GriffinLim(torch.nn.Module):
+    def __init__(self, stft, n_iters=60, momentum=0.99, tol=1e-3,
+                 mel_mean_std=None):
+        """
+        PARAMS
+        ------
+        stft: layers.TacotronSTFT matching the training features
+        n_iters: most iterations an item runs
+        momentum: fast Griffin-Lim momentum, 0 gives plain Griffin-Lim
+        tol: an item stops once an iteration improves its spectral
+            convergence by less than this fraction
+        mel_mean_std: statistics used when the model was trained with
+            normalize_mel, None otherwise
+        """
+        super(GriffinLim, self).__init__()
+        self.stft = stft
+        self.stft_fn = stft.stft_fn
+        self.n_iters = n_iters
+        self.momentum = momentum
+        self.tol = tol
+        self.register_buffer('mel_gram_inverse',
+                             mel_gram_inverse(stft.mel_basis))
+        if mel_mean_std is not None:
+            mel_mean_std = torch.as_tensor(mel_mean_std).float()
+        self.register_buffer('mel_mean_std', mel_mean_std)
+
+    def mel_to_magnitudes(self, mels, mel_lengths=None):
+        """ linear magnitudes (B, n_freq, T) of log-mels (B, n_mel_channels, T),
+        zero past mel_lengths """
+        if self.mel_mean_std is not None:
+            mels = mels * self.mel_mean_std[1] + self.mel_mean_std[0]
+        mels = dynamic_range_decompression(mels)
+        magnitudes = self.stft.mel_transpose(
+            torch.matmul(self.mel_gram_inverse, mels)).clamp(min=0)
+        if mel_lengths is not None:
+            frames = torch.arange(mels.size(2), device=mels.device)
+            magnitudes.masked_fill_(
+                frames >= mel_lengths.to(mels.device).unsqueeze(1).unsqueeze(1), 0)
+        return magnitudes
+
+    def phase_reconstruction(self, magnitudes, mel_lengths=None,
+                             generator=None):
+        """
+        PARAMS
+        ------
+        magnitudes: linear magnitudes (B, n_freq, T), zero past mel_lengths
+        mel_lengths: valid frames of every item, the frames past the longest
+            item still iterating are dropped as the others stop
+
+        RETURNS
+        -------
+        angles: unit complex (B, n_freq, T) estimate of the phase
+        n_iters: LongTensor (B,) of the iterations each item ran
+        """
+        batch_size = magnitudes.size(0)
+        device = magnitudes.device
+        if mel_lengths is not None:
+            mel_lengths = mel_lengths.to(device)
+        angles = torch.polar(
+            torch.ones_like(magnitudes),
+            2 * math.pi * torch.rand(magnitudes.size(), generator=generator,
+                                      device=device))
+        n_iters = torch.zeros(batch_size, dtype=torch.long, device=device)
+        momentum = self.momentum / (1 + self.momentum)
+
+        # the state of the items still iterating, shrunk as items stop
+        active = torch.arange(batch_size, device=device)
+        target, estimate = magnitudes, angles.clone()
+        previous = torch.zeros_like(angles)
+        convergence = torch.full((batch_size,), float('inf'), device=device)
+
+        for i in range(self.n_iters):
+            signal = self.stft_fn.complex_inverse(target * estimate)
+            rebuilt = self.stft_fn.complex_transform(signal.squeeze(1))
+
+            estimate = rebuilt - momentum * previous
+            estimate /= estimate.abs() + 1e-16
+            previous = rebuilt
+            n_iters[active] += 1
+
+            current = spectral_convergence(target, rebuilt.abs())
+            improving = convergence - current > self.tol * current
+            convergence = current
+            if bool(improving.all()) and i + 1 < self.n_iters:
+                continue
+
+            angles[active, :, :target.size(2)] = estimate
+            keep = improving.nonzero().squeeze(1)
+            if len(keep) == 0:
+                break
+            active, target, estimate, previous, convergence = (
+                x[keep] for x in (active, target, estimate, previous, convergence))
+            if mel_lengths is not None:
+                n_frames = int(mel_lengths[active].max())
+                target, estimate, previous = (
+                    x[:, :, :n_frames] for x in (target, estimate, previous))
+        return angles, n_iters
+
+    def forward(self, mels, mel_lengths=None, generator=None):
+        """
+        PARAMS
+        ------
+        mels: log-mels (B, n_mel_channels, T), e.g. mel_outputs_postnet
+        mel_lengths: valid frames of every item, all T if None
+        generator: torch.Generator for the initial random phase
+
+        RETURNS
+        -------
+        audio: (B, samples) waveforms in [-1, 1], zero past audio_lengths
+        audio_lengths: LongTensor (B,)
+        """
+        with torch.no_grad():
+            magnitudes = self.mel_to_magnitudes(mels, mel_lengths)
+            angles, _ = self.phase_reconstruction(
+                magnitudes, mel_lengths, generator)
+            audio = self.stft_fn.complex_inverse(
+                magnitudes * angles).squeeze(1)
+
+        hop_length = self.stft_fn.hop_length
+        if mel_lengths is None:
+            mel_lengths = torch.full((mels.size(0),), mels.size(2),
+                                     dtype=torch.long)
+        audio_lengths = (mel_lengths.cpu() - 1) * hop_length
+        samples = torch.arange(audio.size(1), device=audio.device)
+        audio.masked_fill_(
+            samples >= audio_lengths.to(audio.device).unsqueeze(1), 0)
+        return audio, audio_lengths